@@ -0,0 +1,406 @@
+"""Streaming attachment pipeline for /chat/message uploads.
+
+Oversized uploads are refused from their Content-Length before the body is
+received (main.py); the rest are hashed and scanned in place, in fixed-size
+chunks, and decoded incrementally into line windows (over-long lines are
+cut into window-sized pieces). Each window is pre-filtered with regexes for
+IOCs (IPs, URLs, hashes, CVEs, emails) and error patterns, and only the
+highest-signal windows are kept, so memory stays bounded regardless of file
+size. The survivors are embedded and the ones most relevant to the question
+are packed into the prompt within a token budget.
+
+Scan results (windows, their embeddings and the IOC summary) are cached in a
+local SQLite store keyed by the SHA-256 of the upload, with LRU eviction, so
+re-uploading a file or asking a follow-up about it skips decode and embedding.
+The store holds no filename or owner; the `attachment_id` handed to clients
+is the digest sealed to the caller (main.py), so it can't be used by anyone
+else or to probe whether some content was ever uploaded.
+"""
+import array
+import base64
+import codecs
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+# Scanning runs at a few MB/s on a threadpool worker; the cap bounds how long one upload holds it
+MAX_UPLOAD_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(10 * 1024 * 1024)))
+# Room for the other form fields and multipart framing in a request carrying a max-size file
+FORM_OVERHEAD_BYTES = 64 * 1024
+READ_CHUNK_BYTES = 64 * 1024
+WINDOW_LINES = 20
+WINDOW_CHARS = 1500
+MAX_CANDIDATES = 64
+EXCERPT_TOKEN_BUDGET = int(os.getenv("ATTACHMENT_TOKEN_BUDGET", "800"))
+CHARS_PER_TOKEN = 4
+MAX_IOCS_PER_KIND = 15
+CACHE_PATH = os.getenv("ATTACHMENT_CACHE_PATH", "attachment_cache/attachments.sqlite3")
+CACHE_MAX_BYTES = int(os.getenv("ATTACHMENT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+IOC_PATTERNS = {
+    "ipv4": re.compile(r"\b(?:(?:25[0-5]|2[0-4]\d|1?\d?\d)\.){3}(?:25[0-5]|2[0-4]\d|1?\d?\d)\b"),
+    "ipv6": re.compile(r"\b(?:[0-9a-f]{1,4}:){3,7}[0-9a-f]{1,4}\b", re.IGNORECASE),
+    "url": re.compile(r"\bhttps?://[^\s\"'<>]+", re.IGNORECASE),
+    "email": re.compile(r"\b[\w.+-]+@[\w-]+(?:\.[\w-]+)+\b"),
+    "cve": re.compile(r"\bCVE-\d{4}-\d{4,7}\b", re.IGNORECASE),
+}
+# Substrings (of the lowercased window) without which a pattern can't match; skips most scans
+IOC_HINTS = {"url": "http", "email": "@", "cve": "cve-"}
+# One pass for all three digests, told apart by length
+HASH_PATTERN = re.compile(r"\b[a-f0-9]{32}(?:[a-f0-9]{8}(?:[a-f0-9]{24})?)?\b", re.IGNORECASE)
+HASH_KINDS = {64: "sha256", 40: "sha1", 32: "md5"}
+IOC_KINDS = ("ipv4", "ipv6", "url", "email", "sha256", "sha1", "md5", "cve")
+# Matched against lowercased text: much faster than IGNORECASE
+ERROR_PATTERN = re.compile(
+    r"\b(?:error|fail(?:ed|ure)?|denied|unauthori[sz]ed|forbidden|invalid|refused|critical|fatal|alert|"
+    r"warn(?:ing)?|exception|timeout|attack|malware|brute|exploit|blocked|suspicious)\b"
+)
+WORD_PATTERN = re.compile(r"[a-z0-9]{3,}")
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+class Window:
+    __slots__ = ("index", "start_line", "end_line", "text", "signal")
+
+    def __init__(self, index, start_line, end_line, text, signal):
+        self.index = index
+        self.start_line = start_line
+        self.end_line = end_line
+        self.text = text
+        self.signal = signal
+
+
+class ExcerptScanner:
+    """Incrementally splits decoded text into line windows and keeps the best ones.
+
+    The first and last windows are always retained (headers and the most
+    recent events); the rest compete on their pre-filter score.
+    """
+
+    def __init__(self, max_candidates: int = MAX_CANDIDATES):
+        self.max_candidates = max_candidates
+        self.iocs = {kind: set() for kind in IOC_KINDS}
+        self.total_lines = 0
+        self.total_chars = 0
+        self._partial = ""
+        self._lines = []
+        self._line_chars = 0
+        self._window_lines = 0
+        self._window_start = 1
+        self._next_index = 0
+        self._head = None
+        self._tail = None
+        self._heap = []
+
+    def feed(self, text: str):
+        if not text:
+            return
+        self.total_chars += len(text)
+        parts = (self._partial + text).split("\n")
+        self._partial = parts.pop()
+        for line in parts:
+            self._add_line(line)
+        # No newline in sight (minified JSON, binary): scan the line in window-sized
+        # pieces so memory and per-chunk work stay bounded
+        while len(self._partial) > WINDOW_CHARS:
+            self._add_line(self._partial[:WINDOW_CHARS], new_line=False)
+            self._partial = self._partial[WINDOW_CHARS:]
+
+    def finish(self):
+        if self._partial:
+            self._add_line(self._partial)
+            self._partial = ""
+        self._close_window()
+
+    def _add_line(self, line: str, new_line: bool = True):
+        if new_line:
+            self.total_lines += 1
+            self._window_lines += 1
+        self._lines.append(line.rstrip("\r"))
+        self._line_chars += len(line)
+        if len(self._lines) >= WINDOW_LINES or self._line_chars >= WINDOW_CHARS:
+            self._close_window()
+
+    def _score(self, text: str) -> int:
+        lowered = text.lower()
+        signal = len(ERROR_PATTERN.findall(lowered))
+        for kind, pattern in IOC_PATTERNS.items():
+            hint = IOC_HINTS.get(kind)
+            if hint is not None and hint not in lowered:
+                continue
+            found = pattern.findall(text)
+            signal += 2 * len(found)
+            self._collect(kind, found)
+        for value in HASH_PATTERN.findall(text):
+            signal += 2
+            self._collect(HASH_KINDS[len(value)], (value,))
+        return signal
+
+    def _collect(self, kind: str, found):
+        bucket = self.iocs[kind]
+        for value in found:
+            if len(bucket) >= MAX_IOCS_PER_KIND:
+                break
+            bucket.add(value)
+
+    def _close_window(self):
+        if not self._lines:
+            return
+        text = "\n".join(self._lines)[:WINDOW_CHARS]
+        end_line = self._window_start + max(self._window_lines, 1) - 1
+        window = Window(self._next_index, self._window_start, end_line, text, self._score(text))
+        self._next_index += 1
+        self._window_start += self._window_lines
+        self._lines = []
+        self._line_chars = 0
+        self._window_lines = 0
+
+        if self._head is None:
+            self._head = window
+            return
+        # The previous tail loses its guaranteed slot and competes like any other window.
+        previous, self._tail = self._tail, window
+        if previous is not None:
+            self._offer(previous)
+
+    def _offer(self, window: Window):
+        entry = (window.signal, window.index, window)
+        if len(self._heap) < self.max_candidates:
+            heapq.heappush(self._heap, entry)
+        elif entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+
+    def candidates(self) -> list[Window]:
+        windows = [entry[2] for entry in self._heap]
+        windows.extend(w for w in (self._head, self._tail) if w is not None)
+        return sorted(windows, key=lambda w: w.index)
+
+    def ioc_summary(self) -> str:
+        lines = [f"{kind}: {', '.join(sorted(values))}" for kind, values in self.iocs.items() if values]
+        return "\n".join(lines)
+
+    def result(self, filename: str | None = None) -> "ScannedAttachment":
+        return ScannedAttachment(filename, self.total_lines, self.ioc_summary(), self.candidates())
+
+
+class ScannedAttachment:
+    """What the prompt needs from an upload; this is what the store caches."""
+
+    def __init__(self, filename, total_lines, ioc_summary, windows, embeddings=None, embed_model=None):
+        self.filename = filename
+        self.total_lines = total_lines
+        self.ioc_summary = ioc_summary
+        self.windows = windows
+        self.embeddings = embeddings
+        self.embed_model = embed_model
+
+    def ensure_embeddings(self, embed, model: str | None = None) -> bool:
+        """Embed the windows once per embedding model. Returns True if new embeddings were computed."""
+        if embed is None or not self.windows:
+            return False
+        if self.embeddings is not None and self.embed_model == model:
+            return False
+        try:
+            self.embeddings = [[float(x) for x in v] for v in embed([w.text for w in self.windows])]
+            self.embed_model = model
+            return True
+        except Exception as e:
+            print(f"Error embedding attachment excerpts: {e}")
+            return False
+
+    def select_excerpts(self, question: str, embed=None, token_budget: int = EXCERPT_TOKEN_BUDGET) -> str:
+        """Pack the windows most relevant to `question` into `token_budget`.
+
+        `embed` maps a list of strings to vectors; without it, relevance falls
+        back to word overlap with the question.
+        """
+        windows = self.windows
+        if not windows:
+            return ""
+        relevance = _relevance(question, [w.text for w in windows], embed, self.embeddings)
+        ranked = sorted(
+            zip(windows, relevance),
+            key=lambda pair: pair[1] + 0.1 * math.log1p(pair[0].signal),
+            reverse=True,
+        )
+
+        summary = self.ioc_summary
+        budget_chars = token_budget * CHARS_PER_TOKEN - len(summary)
+        chosen = []
+        for window, _ in ranked:
+            cost = len(window.text) + 24
+            if cost > budget_chars:
+                continue
+            chosen.append(window)
+            budget_chars -= cost
+        chosen.sort(key=lambda w: w.index)
+
+        parts = [f"[{self.total_lines} lines, {len(chosen)} relevant excerpts shown]"]
+        if summary:
+            parts.append("Indicators found:\n" + summary)
+        parts.extend(f"[lines {w.start_line}-{w.end_line}]\n{w.text}" for w in chosen)
+        return "\n\n".join(parts)
+
+
+def _cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a))
+    nb = math.sqrt(sum(y * y for y in b))
+    return dot / (na * nb) if na and nb else 0.0
+
+
+def _relevance(question: str, texts: list[str], embed=None, embeddings=None) -> list[float]:
+    if embed is not None and embeddings is not None and question.strip():
+        try:
+            query = embed([question])[0]
+            return [_cosine(query, v) for v in embeddings]
+        except Exception as e:
+            print(f"Error embedding attachment question: {e}")
+    words = set(WORD_PATTERN.findall(question.lower()))
+    if not words:
+        return [0.0] * len(texts)
+    return [len(words & set(WORD_PATTERN.findall(t.lower()))) / len(words) for t in texts]
+
+
+def hash_upload(fileobj, max_bytes: int = MAX_UPLOAD_BYTES) -> str:
+    """SHA-256 of an already-received upload, read in place (blocking); rewinds it.
+
+    Raises AttachmentTooLarge before reading anything if the file is over the cap.
+    """
+    fileobj.seek(0, os.SEEK_END)
+    if fileobj.tell() > max_bytes:
+        raise AttachmentTooLarge(f"Attachment exceeds the {max_bytes // (1024 * 1024)} MB limit.")
+    fileobj.seek(0)
+    digest = hashlib.sha256()
+    while True:
+        chunk = fileobj.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def scan_file(fileobj, filename: str | None = None) -> ScannedAttachment:
+    """Decode and pre-filter a binary file object chunk by chunk (blocking)."""
+    scanner = ExcerptScanner()
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    while True:
+        chunk = fileobj.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        scanner.feed(decoder.decode(chunk))
+    scanner.feed(decoder.decode(b"", final=True))
+    scanner.finish()
+    return scanner.result(filename)
+
+
+# =========================
+# CONTENT-HASH STORE
+# =========================
+def _pack_vector(vector) -> str:
+    return base64.b64encode(array.array("f", vector).tobytes()).decode("ascii")
+
+
+def _unpack_vector(data: str) -> list[float]:
+    values = array.array("f")
+    values.frombytes(base64.b64decode(data))
+    return values.tolist()
+
+
+def _encode(attachment: ScannedAttachment) -> bytes:
+    # Shared by everyone who uploads the same bytes, so nothing about the uploader
+    payload = {
+        "total_lines": attachment.total_lines,
+        "ioc_summary": attachment.ioc_summary,
+        "windows": [[w.index, w.start_line, w.end_line, w.text, w.signal] for w in attachment.windows],
+        "embeddings": (
+            [_pack_vector(v) for v in attachment.embeddings] if attachment.embeddings is not None else None
+        ),
+        "embed_model": attachment.embed_model,
+    }
+    return zlib.compress(json.dumps(payload).encode("utf-8"))
+
+
+def _decode(blob: bytes) -> ScannedAttachment:
+    payload = json.loads(zlib.decompress(blob).decode("utf-8"))
+    embeddings = payload.get("embeddings")
+    return ScannedAttachment(
+        None,
+        payload.get("total_lines", 0),
+        payload.get("ioc_summary", ""),
+        [Window(*w) for w in payload.get("windows", [])],
+        [_unpack_vector(v) for v in embeddings] if embeddings is not None else None,
+        payload.get("embed_model"),
+    )
+
+
+class AttachmentStore:
+    """SQLite-backed cache of scanned attachments keyed by content hash, LRU-evicted by size."""
+
+    def __init__(self, path: str = CACHE_PATH, max_bytes: int = CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS attachments ("
+            "digest TEXT PRIMARY KEY, payload BLOB NOT NULL, bytes INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS attachments_last_used_idx ON attachments (last_used)")
+        self._conn.commit()
+
+    def get(self, digest: str) -> ScannedAttachment | None:
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM attachments WHERE digest=?", (digest,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE attachments SET last_used=? WHERE digest=?", (time.time(), digest))
+            self._conn.commit()
+        try:
+            return _decode(row[0])
+        except Exception as e:
+            print(f"Discarding unreadable cached attachment {digest[:12]}: {e}")
+            self.delete(digest)
+            return None
+
+    def put(self, digest: str, attachment: ScannedAttachment):
+        blob = _encode(attachment)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO attachments (digest, payload, bytes, last_used) VALUES (?, ?, ?, ?)",
+                (digest, blob, len(blob), time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def delete(self, digest: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM attachments WHERE digest=?", (digest,))
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM attachments").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for digest, size in self._conn.execute(
+            "SELECT digest, bytes FROM attachments ORDER BY last_used ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM attachments WHERE digest=?", (digest,))
+            total -= size
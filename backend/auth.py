@@ -0,0 +1,177 @@
+"""Google sign-in verification and the backend's own session tokens.
+
+- Google's signing certs are fetched through `CachingRequest`, which reuses
+  one keep-alive HTTP session and serves the certs from memory for as long
+  as Google's Cache-Control max-age allows.
+- Verified ID-token claims are cached until the token's `exp`, so repeated
+  logins with the same token skip signature checks entirely.
+- After sign-in the backend issues a session token,
+  `base64url(json claims).base64url(hmac-sha256)`, signed with
+  BACKEND_SESSION_SECRET. Later calls send it as `Authorization: Bearer ...`
+  and it is checked locally, with no call to Google or the database.
+
+Without BACKEND_SESSION_SECRET a random per-process secret is used, so
+tokens don't survive restarts or work across workers; set it in production.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import threading
+import time
+
+import requests
+from fastapi import HTTPException, Request
+from google.auth import transport
+from google.auth.transport import requests as google_requests
+from google.oauth2 import id_token
+
+import metrics
+
+SESSION_TTL_SECONDS = int(os.getenv("BACKEND_SESSION_TTL_SECONDS", str(12 * 3600)))
+CLAIMS_CACHE_SIZE = int(os.getenv("GOOGLE_CLAIMS_CACHE_SIZE", "10000"))
+_SECRET = os.getenv("BACKEND_SESSION_SECRET", "").encode("utf-8")
+if not _SECRET:
+    print("[backend] BACKEND_SESSION_SECRET not set; session tokens are only valid in this process")
+    _SECRET = secrets.token_bytes(32)
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+class _CachedResponse(transport.Response):
+    def __init__(self, status, headers, data):
+        self._status, self._headers, self._data = status, headers, data
+
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def headers(self):
+        return self._headers
+
+    @property
+    def data(self):
+        return self._data
+
+
+class CachingRequest(transport.Request):
+    """google-auth transport that caches GET responses for their Cache-Control max-age."""
+
+    def __init__(self):
+        self._inner = google_requests.Request(session=requests.Session())
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, url, method="GET", body=None, headers=None, timeout=None, **kwargs):
+        if method != "GET":
+            return self._inner(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(url)
+        if entry is not None and entry[0] > now:
+            metrics.CACHE_EVENTS.inc(cache="google_certs", result="hit")
+            return entry[1]
+        metrics.CACHE_EVENTS.inc(cache="google_certs", result="miss")
+        response = self._inner(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+        match = _MAX_AGE.search(response.headers.get("cache-control", "") or "")
+        if response.status == 200 and match:
+            cached = _CachedResponse(response.status, dict(response.headers), response.data)
+            with self._lock:
+                self._cache[url] = (now + int(match.group(1)), cached)
+        return response
+
+
+_request = CachingRequest()
+_claims = {}
+_claims_lock = threading.Lock()
+
+
+def verify_google_token(token: str, audience: str) -> dict:
+    """Verified claims of a Google ID token; raises ValueError if it is invalid."""
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    now = time.time()
+    with _claims_lock:
+        cached = _claims.get(key)
+    if cached is not None and cached.get("exp", 0) > now:
+        metrics.CACHE_EVENTS.inc(cache="google_claims", result="hit")
+        return cached
+    metrics.CACHE_EVENTS.inc(cache="google_claims", result="miss")
+    claims = id_token.verify_oauth2_token(token, _request, audience)
+    with _claims_lock:
+        if len(_claims) >= CLAIMS_CACHE_SIZE:
+            for stale in [k for k, v in _claims.items() if v.get("exp", 0) <= now]:
+                del _claims[stale]
+            while len(_claims) >= CLAIMS_CACHE_SIZE:
+                del _claims[next(iter(_claims))]
+        _claims[key] = claims
+    return claims
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def issue_session_token(user_id: str, email: str, ttl: int = SESSION_TTL_SECONDS) -> tuple[str, int]:
+    """Returns (token, expiry as a unix timestamp)."""
+    now = int(time.time())
+    payload = _b64encode(json.dumps(
+        {"sub": str(user_id), "email": email, "iat": now, "exp": now + ttl}, separators=(",", ":"),
+    ).encode("utf-8"))
+    signature = _b64encode(hmac.new(_SECRET, payload.encode("ascii"), hashlib.sha256).digest())
+    return f"{payload}.{signature}", now + ttl
+
+
+def verify_session_token(token: str) -> dict | None:
+    """Claims of a valid, unexpired session token, else None."""
+    try:
+        payload, signature = token.split(".", 1)
+        expected = hmac.new(_SECRET, payload.encode("ascii"), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except Exception:
+        return None
+    return claims if claims.get("exp", 0) > time.time() else None
+
+
+def seal(scope: str, value: str) -> str:
+    """`value` with a tag binding it to `scope`; only `unseal` with the same scope returns it."""
+    tag = hmac.new(_SECRET, f"{scope}\x00{value}".encode("utf-8"), hashlib.sha256).digest()[:16]
+    return f"{value}.{_b64encode(tag)}"
+
+
+def unseal(scope: str, token: str) -> str | None:
+    """The value sealed for `scope`, else None (wrong scope, tampered or malformed)."""
+    value, _, tag = (token or "").rpartition(".")
+    if not value:
+        return None
+    expected = seal(scope, value).rpartition(".")[2]
+    return value if hmac.compare_digest(expected, tag) else None
+
+
+def current_session(request: Request) -> dict | None:
+    """Dependency: session claims from `Authorization: Bearer`, None when no token is sent.
+
+    A token that is present but invalid or expired is rejected with 401.
+    """
+    header = request.headers.get("authorization", "")
+    if not header.lower().startswith("bearer "):
+        return None
+    claims = verify_session_token(header[7:].strip())
+    if claims is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired session token.")
+    return claims
+
+
+def check_user(session: dict | None, user_id) -> None:
+    """Reject requests whose session token belongs to a different user than `user_id`."""
+    if session is not None and user_id is not None and str(user_id) != session.get("sub"):
+        raise HTTPException(status_code=403, detail="Session token does not match user.")
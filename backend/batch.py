@@ -0,0 +1,179 @@
+"""Run a prompt set through the answer pipeline in bulk.
+
+    python batch.py questions.jsonl --out results.jsonl --min-hit-rate 0.9
+    python batch.py faq_prompts.jsonl --all-styles --faq faq_answers.json
+
+Input is JSONL, one object per line; only `prompt` is required:
+    {"prompt": "How do I spot phishing?", "style": "short", "expect": ["phishing"]}
+`style` defaults to long, or every style with --all-styles. `expect` lists
+strings of which at least one should appear in the retrieved context for a
+retrieval hit; without it, any non-empty context counts as a hit.
+
+Each prompt goes through main.answer_turn, the same pipeline as call_llm,
+with the FAQ table and answer cache bypassed so every answer is generated
+and timed. At most --concurrency prompts are in flight against Ollama.
+--out gets one JSON line per (prompt, style) with the answer, the retrieval
+hit, the total latency and the per-stage timings from the metrics trace.
+The summary (hit rate, latency percentiles, per-stage p50/p95) is printed
+and, with --report, written to a file.
+
+With --faq, generated answers are written as the precomputed answer table
+(see faq.py) that the chat routes consult before generating; point
+FAQ_ANSWERS_PATH at it.
+
+Importing main connects to the database exactly like the server
+(PY_DATABASE_URL etc.); SCHEMA_MIGRATE=0 skips its startup migrations.
+The run uses its own in-memory cache, never the host's shared one.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+# Before the local imports, which read their settings at import time (as in main.py)
+load_dotenv()
+
+import faq
+import metrics
+from bench.common import percentile, summarize, write_report
+
+STYLES = ("long", "short", "summary", "main")
+
+
+def load_prompts(path: str, all_styles: bool = False) -> list[dict]:
+    """One job per (prompt, style)."""
+    jobs = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if not item.get("prompt"):
+                raise SystemExit(f"{path}:{number}: missing prompt")
+            styles = STYLES if all_styles else (item.get("style") or "long",)
+            jobs.extend(dict(item, style=style) for style in styles)
+    return jobs
+
+
+def retrieval_hit(context: str, expect: list[str] | None) -> bool:
+    if not expect:
+        return bool(context)
+    lowered = context.lower()
+    return any(e.lower() in lowered for e in expect)
+
+
+def run_one(backend, job: dict) -> tuple[dict, dict]:
+    """Answer one job. Returns (output record, answer_turn result)."""
+    trace = metrics.start_trace()
+    started = time.perf_counter()
+    try:
+        result = backend.answer_turn(job["prompt"], style=job["style"], use_cache=False)
+    except Exception as e:
+        # Failed before retrieval finished: no hit/miss to report
+        result = {"answer": None, "english_answer": None, "context": None, "cache_key": None, "source": "error", "error": str(e)}
+    seconds = time.perf_counter() - started
+    stages = {}
+    for name, stage_seconds in trace:
+        stages[name] = round(stages.get(name, 0.0) + stage_seconds * 1000, 2)
+    record = {
+        "prompt": job["prompt"],
+        "style": job["style"],
+        "answer": result["answer"],
+        "source": result["source"],
+        "error": result["error"],
+        "retrieval_hit": (
+            None if result["source"] == "greeting" or result["context"] is None
+            else retrieval_hit(result["context"], job.get("expect"))
+        ),
+        "context_chars": len(result["context"] or ""),
+        "ms": round(seconds * 1000, 2),
+        "stages_ms": stages,
+    }
+    return record, result
+
+
+def summarize_run(records: list[dict], elapsed: float) -> dict:
+    answered = [r for r in records if r["source"] != "error"]
+    retrieved = [r for r in records if r["retrieval_hit"] is not None]
+    stages = {}
+    for record in answered:
+        for name, ms in record["stages_ms"].items():
+            stages.setdefault(name, []).append(ms)
+    return {
+        "prompts": len(records),
+        "latency": summarize([r["ms"] / 1000 for r in answered], elapsed, errors=len(records) - len(answered)),
+        "retrieval_hit_rate": round(sum(r["retrieval_hit"] for r in retrieved) / len(retrieved), 3) if retrieved else None,
+        "stages_ms": {
+            name: {"p50": round(percentile(values, 50), 2), "p95": round(percentile(values, 95), 2)}
+            for name, values in sorted(stages.items())
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL prompt set through the answer pipeline.")
+    parser.add_argument("prompts", help="JSONL file of prompts")
+    parser.add_argument("--out", default=None, help="per-prompt results (JSONL)")
+    parser.add_argument("--report", default=None, help="also write the summary JSON here")
+    parser.add_argument("--concurrency", type=int, default=2, help="prompts in flight against Ollama")
+    parser.add_argument("--all-styles", action="store_true", help=f"answer each prompt in every style ({', '.join(STYLES)})")
+    parser.add_argument("--faq", default=None, metavar="PATH", help="write the answers as a precomputed answer table")
+    parser.add_argument("--min-hit-rate", type=float, default=None, help="exit 1 below this retrieval hit rate")
+    parser.add_argument("--max-p95-ms", type=float, default=None, help="exit 1 above this p95 latency")
+    args = parser.parse_args()
+
+    jobs = load_prompts(args.prompts, args.all_styles)
+    # A private cache: timings aren't skewed by, and results don't leak into, a server on this host
+    os.environ["SHARED_CACHE"] = "memory"
+    import main as backend
+
+    records, results = [None] * len(jobs), [None] * len(jobs)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency), thread_name_prefix="batch") as pool:
+        futures = {pool.submit(run_one, backend, job): i for i, job in enumerate(jobs)}
+        for done, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            records[i], results[i] = future.result()
+            print(
+                f"[{done}/{len(jobs)}] {records[i]['ms']:.0f} ms {records[i]['source']} "
+                f"({jobs[i]['style']}): {jobs[i]['prompt'][:60]}",
+                file=sys.stderr,
+            )
+    elapsed = time.perf_counter() - started
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    if args.faq:
+        entries = [
+            {"key": result["cache_key"], "prompt": job["prompt"], "style": job["style"], "answer": result["english_answer"]}
+            for job, result in zip(jobs, results)
+            if result["source"] == "llm" and result["cache_key"] and result["english_answer"]
+        ]
+        faq.write(args.faq, entries, {
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "model": backend.MODEL_NAME,
+            "embed_model": backend.retriever.model_id,
+        })
+        print(f"Wrote {len(entries)} precomputed answers to {args.faq}", file=sys.stderr)
+
+    summary = summarize_run(records, elapsed)
+    failures = []
+    hit_rate = summary["retrieval_hit_rate"]
+    if args.min_hit_rate is not None and hit_rate is not None and hit_rate < args.min_hit_rate:
+        failures.append(f"retrieval_hit_rate {hit_rate} < {args.min_hit_rate}")
+    if args.max_p95_ms is not None and summary["latency"]["p95_ms"] > args.max_p95_ms:
+        failures.append(f"p95_ms {summary['latency']['p95_ms']} > {args.max_p95_ms}")
+    write_report({"summary": summary, "regressions": failures}, args.report)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+"""Benchmark and load-test suite for the chat backend.
+
+Everything runs against local stand-ins so results are reproducible:
+
+- `fake_ollama`  -- Ollama-compatible /api/chat with configurable TTFT and tokens/s
+- `stubs`        -- drop-in replacement for googletrans.Translator
+- `postgres`     -- disposable Postgres cluster (or BENCH_DATABASE_URL)
+- `load`         -- concurrent load against the chat routes, with regression thresholds
+- `retrieval`    -- retrieve_context microbenchmark
+- `ingest`       -- ingest_chroma.py chunking/embedding throughput
+
+Run from the backend directory, e.g. `python -m bench.load --concurrency 8`.
+"""
@@ -0,0 +1,130 @@
+"""Shared helpers: latency statistics, process memory and report output."""
+import json
+import math
+import os
+import socket
+import threading
+import time
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def percentile(values, pct: float) -> float:
+    """Nearest-rank percentile; `values` need not be sorted."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(latencies, elapsed: float, errors: int = 0) -> dict:
+    """Latency percentiles (ms) and throughput for one scenario."""
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+        "rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+
+
+def rss_bytes(pid: int | None = None) -> int:
+    """Resident set size of a process (Linux /proc), 0 if unavailable."""
+    try:
+        with open(f"/proc/{pid or os.getpid()}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class MemorySampler:
+    """Samples a process's RSS in the background and tracks the peak."""
+
+    def __init__(self, pid: int | None = None, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.start_rss = 0
+        self.peak_rss = 0
+        self.end_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, rss_bytes(self.pid))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = rss_bytes(self.pid)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.end_rss = rss_bytes(self.pid)
+
+    def report(self) -> dict:
+        mb = 1024 * 1024
+        return {
+            "start_rss_mb": round(self.start_rss / mb, 1),
+            "peak_rss_mb": round(self.peak_rss / mb, 1),
+            "end_rss_mb": round(self.end_rss / mb, 1),
+        }
+
+
+def check_thresholds(results: dict, thresholds: dict) -> list[str]:
+    """Compare scenario results against `{scenario: {metric: limit}}`.
+
+    `*_ms`, `*_mb` and `errors` limits are maxima; `rps` is a minimum.
+    """
+    failures = []
+    for scenario, limits in thresholds.items():
+        result = results.get(scenario)
+        if result is None:
+            continue
+        for metric, limit in limits.items():
+            value = result.get(metric)
+            if value is None:
+                continue
+            if metric == "rps" and value < limit:
+                failures.append(f"{scenario}.{metric} = {value} < {limit}")
+            elif metric != "rps" and value > limit:
+                failures.append(f"{scenario}.{metric} = {value} > {limit}")
+    return failures
+
+
+def load_thresholds(path: str | None) -> dict:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_report(report: dict, path: str | None):
+    text = json.dumps(report, indent=2, default=str)
+    print(text)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
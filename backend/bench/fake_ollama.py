@@ -0,0 +1,130 @@
+"""Ollama-compatible /api/chat stand-in with configurable latency.
+
+    python -m bench.fake_ollama --port 11500 --ttft-ms 300 --tokens-per-sec 25 --tokens 120
+
+Streams NDJSON chunks like Ollama does and finishes with a `done` chunk that
+carries `prompt_eval_count`, `eval_count` and the matching durations, so the
+backend's metrics see realistic statistics.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "Enable multi-factor authentication on every account. Patch exposed services promptly. "
+    "Review firewall rules and restrict inbound ports. Rotate credentials after any suspected compromise. "
+    "Monitor logs for repeated failed logins and unusual outbound traffic."
+).split()
+
+
+class FakeOllamaConfig:
+    def __init__(self, ttft_ms: float = 300.0, tokens_per_sec: float = 25.0, tokens: int = 120):
+        self.ttft = ttft_ms / 1000.0
+        self.tokens_per_sec = tokens_per_sec
+        self.tokens = tokens
+
+
+def _make_handler(config: FakeOllamaConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _final_stats(self, prompt_chars: int, started: float) -> dict:
+            eval_ns = int(config.tokens / config.tokens_per_sec * 1e9)
+            prompt_tokens = max(1, prompt_chars // 4)
+            return {
+                "done": True,
+                "total_duration": int((time.perf_counter() - started) * 1e9),
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(config.ttft * 1e9),
+                "eval_count": config.tokens,
+                "eval_duration": eval_ns,
+            }
+
+        def do_POST(self):
+            started = time.perf_counter()
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            prompt_chars = sum(len(m.get("content", "")) for m in body.get("messages", []))
+            model = body.get("model", "fake")
+            time.sleep(config.ttft)
+            delay = 1.0 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0.0
+
+            if not body.get("stream", True):
+                time.sleep(delay * config.tokens)
+                text = " ".join(WORDS[i % len(WORDS)] for i in range(config.tokens))
+                payload = {"model": model, "message": {"role": "assistant", "content": text}}
+                payload.update(self._final_stats(prompt_chars, started))
+                data = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def send(obj):
+                line = json.dumps(obj).encode() + b"\n"
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+
+            for i in range(config.tokens):
+                word = WORDS[i % len(WORDS)]
+                send({"model": model, "message": {"role": "assistant", "content": word + " "}, "done": False})
+                if delay:
+                    time.sleep(delay)
+            final = {"model": model, "message": {"role": "assistant", "content": ""}}
+            final.update(self._final_stats(prompt_chars, started))
+            send(final)
+            self.wfile.write(b"0\r\n\r\n")
+
+    return Handler
+
+
+class FakeOllama:
+    """Run the fake server on a background thread: `with FakeOllama(port, cfg): ...`."""
+
+    def __init__(self, port: int, config: FakeOllamaConfig | None = None):
+        self.port = port
+        self.config = config or FakeOllamaConfig()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _make_handler(self.config))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/api/chat"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--ttft-ms", type=float, default=300.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=25.0)
+    parser.add_argument("--tokens", type=int, default=120)
+    args = parser.parse_args()
+    config = FakeOllamaConfig(args.ttft_ms, args.tokens_per_sec, args.tokens)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), _make_handler(config))
+    print(f"Fake Ollama listening on http://127.0.0.1:{args.port}/api/chat")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Ingestion throughput for ingest_chroma.py (chunking + embedding + insert).
+
+    python -m bench.ingest --repeat 10
+
+Ingests the knowledge base, repeated `--repeat` times, into a throwaway
+Chroma directory so the real store is never touched. The first pass starts
+from an empty embedding cache; the second re-ingests the same chunks and
+measures the cache-hit path a rebuild takes.
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import chromadb
+
+from bench.common import MemorySampler, check_thresholds, load_thresholds, write_report
+from bench.load import DEFAULT_THRESHOLDS
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark knowledge-base ingestion.")
+    parser.add_argument("--repeat", type=int, default=10, help="copies of knowledge_base.txt to ingest")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--thresholds", default=str(DEFAULT_THRESHOLDS))
+    parser.add_argument("--report", default=None)
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(BACKEND_DIR))
+    import embeddings
+    import ingest_chroma
+
+    text = (BACKEND_DIR / ingest_chroma.KB_PATH).read_text(encoding="utf-8")
+    t0 = time.perf_counter()
+    chunks = ingest_chroma.chunk_document(text * args.repeat)
+    chunk_seconds = time.perf_counter() - t0
+
+    workdir = tempfile.mkdtemp(prefix="securum-bench-chroma-")
+    try:
+        client = chromadb.PersistentClient(path=workdir)
+        model_id, backend = embeddings.load_backend()
+        embedder = embeddings.EmbeddingService(model_id, backend, cache_dir=str(Path(workdir) / "embedding_cache"))
+        with MemorySampler() as mem:
+            t0 = time.perf_counter()
+            ingest_chroma.ingest(
+                client, chunks, name="bench_ingest", embedding_func=embedder, batch_size=args.batch_size,
+            )
+            ingest_seconds = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            ingest_chroma.ingest(
+                client, chunks, name="bench_ingest_warm", embedding_func=embedder, batch_size=args.batch_size,
+            )
+            warm_seconds = time.perf_counter() - t0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "chunks": len(chunks),
+        "chars": len(text) * args.repeat,
+        "chunking_ms": round(chunk_seconds * 1000, 2),
+        "ingest_ms": round(ingest_seconds * 1000, 2),
+        "chunks_per_sec": round(len(chunks) / ingest_seconds, 2) if ingest_seconds else 0.0,
+        "warm_ingest_ms": round(warm_seconds * 1000, 2),
+        "embed_model": model_id,
+        **mem.report(),
+    }
+    results = {"ingest": result}
+    failures = check_thresholds(results, load_thresholds(args.thresholds))
+    write_report({"results": results, "regressions": failures}, args.report)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Scripted concurrent load against the chat routes.
+
+    python -m bench.load --concurrency 8 --requests 200 --report bench_report.json
+
+Starts the fake Ollama, a disposable Postgres and the backend (with the stub
+translator) as a subprocess, then drives /chat/message, /chat/stream,
+/chat/sessions, /chat/search and /chat/download. Reports p50/p95/p99 latency,
+throughput and server memory per scenario and exits non-zero when a result
+crosses a limit in thresholds.json.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+from bench.common import (
+    MemorySampler, check_thresholds, free_port, load_thresholds, summarize, wait_for_port, write_report,
+)
+from bench.fake_ollama import FakeOllama, FakeOllamaConfig
+from bench.postgres import DisposablePostgres
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_THRESHOLDS = Path(__file__).resolve().parent / "thresholds.json"
+
+PROMPTS = [
+    "How do I detect a phishing email?",
+    "What should I do after a ransomware infection?",
+    "How can I harden SSH on a Linux server?",
+    "Is https://my.university.edu/login a safe link?",
+    "[fr] Comment sécuriser mon routeur Wi-Fi ?",
+]
+
+
+def unique_prompt(i: int) -> str:
+    """PROMPTS[i], made unique so concurrent requests never coalesce or share a cached answer or embedding."""
+    return f"{PROMPTS[i % len(PROMPTS)]} (request {i})"
+
+
+class LoadRunner:
+    def __init__(self, base_url: str, concurrency: int, total: int):
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.total = total
+        self.user_id = f"bench_{uuid.uuid4().hex[:8]}"
+        self.session_id = None
+        self._local = threading.local()
+
+    def _http(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def seed(self):
+        """Create one persisted session so listing/search/download have data."""
+        r = self._http().post(
+            f"{self.base_url}/chat/message",
+            data={"prompt": PROMPTS[0], "user_id": self.user_id, "guest": "false"},
+            timeout=120,
+        )
+        r.raise_for_status()
+        self.session_id = r.json()["session_id"]
+
+    # --- scenarios: each performs one request and raises on failure ---
+    def chat_message(self, i: int):
+        r = self._http().post(
+            f"{self.base_url}/chat/message",
+            data={"prompt": unique_prompt(i), "user_id": self.user_id, "guest": "true"},
+            timeout=120,
+        )
+        r.raise_for_status()
+
+    def chat_stream(self, i: int):
+        r = self._http().post(
+            f"{self.base_url}/chat/stream",
+            json={"prompt": unique_prompt(i), "user_id": self.user_id, "guest": True},
+            stream=True,
+            timeout=120,
+        )
+        r.raise_for_status()
+        for _ in r.iter_content(chunk_size=None):
+            pass
+
+    def chat_sessions(self, i: int):
+        self._http().get(f"{self.base_url}/chat/sessions/{self.user_id}", timeout=30).raise_for_status()
+
+    def chat_search(self, i: int):
+        self._http().get(
+            f"{self.base_url}/chat/search", params={"user_id": self.user_id, "q": "phishing"}, timeout=30,
+        ).raise_for_status()
+
+    def chat_download(self, i: int):
+        fmt = ("csv", "docx", "pdf")[i % 3]
+        self._http().get(
+            f"{self.base_url}/chat/download/{self.session_id}", params={"format": fmt}, timeout=60,
+        ).raise_for_status()
+
+    def run(self, scenario) -> dict:
+        latencies, errors = [], 0
+        lock = threading.Lock()
+
+        def one(i):
+            nonlocal errors
+            started = time.perf_counter()
+            try:
+                scenario(i)
+            except Exception:
+                with lock:
+                    errors += 1
+                return
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            list(pool.map(one, range(self.total)))
+        return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the chat backend against local stand-ins.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario")
+    parser.add_argument("--ttft-ms", type=float, default=300.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=40.0)
+    parser.add_argument("--tokens", type=int, default=80)
+    parser.add_argument("--scenarios", default="chat_message,chat_stream,chat_sessions,chat_search,chat_download")
+    parser.add_argument("--thresholds", default=str(DEFAULT_THRESHOLDS))
+    parser.add_argument("--report", default=None, help="write the JSON report to this path")
+    args = parser.parse_args()
+
+    ollama_port, app_port = free_port(), free_port()
+    config = FakeOllamaConfig(args.ttft_ms, args.tokens_per_sec, args.tokens)
+    with FakeOllama(ollama_port, config) as ollama, DisposablePostgres() as pg:
+        env = dict(
+            os.environ, PY_DATABASE_URL=pg.dsn, DATABASE_URL=pg.dsn, OLLAMA_API_URL=ollama.url,
+            # Private, cold caches: nothing shared with other instances on this host, and
+            # the chat scenarios measure generation rather than answer-cache hits
+            SHARED_CACHE="memory", ANSWER_CACHE_TTL_SECONDS="0",
+            # All bench traffic is guests from 127.0.0.1, far over the guest limits
+            RATE_LIMIT_ENABLED="0",
+        )
+        server = subprocess.Popen([sys.executable, "-m", "bench.serve", str(app_port)], cwd=BACKEND_DIR, env=env)
+        try:
+            wait_for_port(app_port, timeout=120)
+            runner = LoadRunner(f"http://127.0.0.1:{app_port}", args.concurrency, args.requests)
+            runner.seed()
+            results = {}
+            for name in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+                with MemorySampler(server.pid) as mem:
+                    results[name] = runner.run(getattr(runner, name))
+                results[name].update(mem.report())
+                print(f"{name}: {results[name]}", file=sys.stderr)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    failures = check_thresholds(results, load_thresholds(args.thresholds))
+    write_report(
+        {
+            "config": {
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "ttft_ms": args.ttft_ms,
+                "tokens_per_sec": args.tokens_per_sec,
+                "tokens": args.tokens,
+            },
+            "results": results,
+            "regressions": failures,
+        },
+        args.report,
+    )
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Disposable Postgres for benchmarks.
+
+Uses BENCH_DATABASE_URL when set; otherwise initialises a throwaway cluster
+with the local `initdb`/`pg_ctl` binaries in a temp directory and removes it
+on exit. Either way the backend's own migrations (schema.py) are applied,
+so benchmarks run against the production indexes.
+"""
+import glob
+import os
+import shutil
+import subprocess
+import tempfile
+
+import psycopg2
+
+import schema
+from bench.common import free_port
+
+
+def _pg_binary(name: str) -> str | None:
+    found = shutil.which(name)
+    if found:
+        return found
+    candidates = sorted(glob.glob(f"/usr/lib/postgresql/*/bin/{name}"))
+    return candidates[-1] if candidates else None
+
+
+class DisposablePostgres:
+    def __init__(self):
+        self.dsn = None
+        self._dir = None
+        self._pg_ctl = None
+
+    def __enter__(self):
+        url = os.getenv("BENCH_DATABASE_URL")
+        if url:
+            self.dsn = url
+        else:
+            initdb, self._pg_ctl = _pg_binary("initdb"), _pg_binary("pg_ctl")
+            if not initdb or not self._pg_ctl:
+                raise RuntimeError("initdb/pg_ctl not found; set BENCH_DATABASE_URL to a scratch database")
+            self._dir = tempfile.mkdtemp(prefix="securum-bench-pg-")
+            data = os.path.join(self._dir, "data")
+            port = free_port()
+            subprocess.run(
+                [initdb, "-D", data, "-U", "bench", "-A", "trust"],
+                check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            subprocess.run(
+                [
+                    self._pg_ctl, "-D", data, "-l", os.path.join(self._dir, "postgres.log"), "-w",
+                    "-o", f"-p {port} -k {self._dir} -c listen_addresses=127.0.0.1 -c fsync=off",
+                    "start",
+                ],
+                check=True, stdout=subprocess.DEVNULL,
+            )
+            self.dsn = f"postgresql://bench@127.0.0.1:{port}/postgres"
+        conn = psycopg2.connect(self.dsn)
+        try:
+            schema.migrate(conn)
+        finally:
+            conn.close()
+        return self
+
+    def __exit__(self, *exc):
+        if self._dir:
+            subprocess.run(
+                [self._pg_ctl, "-D", os.path.join(self._dir, "data"), "-m", "immediate", "stop"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            shutil.rmtree(self._dir, ignore_errors=True)
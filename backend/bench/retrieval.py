@@ -0,0 +1,54 @@
+"""Microbenchmark for main.retrieve_context against the on-disk Chroma store.
+
+    python -m bench.retrieval --iterations 200
+
+Importing main opens the DB pool, so this uses the disposable Postgres too.
+Translation and Ollama are never called.
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+from bench.common import MemorySampler, check_thresholds, load_thresholds, summarize, write_report
+from bench.load import DEFAULT_THRESHOLDS, unique_prompt
+from bench.postgres import DisposablePostgres
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieve_context.")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--thresholds", default=str(DEFAULT_THRESHOLDS))
+    parser.add_argument("--report", default=None)
+    args = parser.parse_args()
+
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, str(BACKEND_DIR))
+    with DisposablePostgres() as pg:
+        os.environ["PY_DATABASE_URL"] = pg.dsn
+        import main as backend
+
+        for i in range(args.warmup):
+            backend.retrieve_context(unique_prompt(args.iterations + i))
+
+        latencies = []
+        with MemorySampler() as mem:
+            started = time.perf_counter()
+            for i in range(args.iterations):
+                t0 = time.perf_counter()
+                backend.retrieve_context(unique_prompt(i))
+                latencies.append(time.perf_counter() - t0)
+            elapsed = time.perf_counter() - started
+
+    results = {"retrieve_context": dict(summarize(latencies, elapsed), **mem.report())}
+    failures = check_thresholds(results, load_thresholds(args.thresholds))
+    write_report({"results": results, "regressions": failures}, args.report)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""Run the backend app in-process with the stub translator (used by bench.load).
+
+    python -m bench.serve <port>
+
+Database and Ollama endpoints come from the environment, exactly as in
+production (PY_DATABASE_URL / OLLAMA_API_URL).
+"""
+import os
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def run(port: int):
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, str(BACKEND_DIR))
+    # Keep benchmark state out of the host-wide /dev/shm cache other instances use
+    os.environ.setdefault("SHARED_CACHE", "memory")
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+    import uvicorn
+    import main as backend
+    from bench.stubs import StubTranslator
+
+    backend.Translator = StubTranslator
+    uvicorn.run(backend.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]))
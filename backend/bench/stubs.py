@@ -0,0 +1,41 @@
+"""Offline stand-in for googletrans.Translator.
+
+Treats every input as English unless it starts with a `[xx]` language tag,
+which lets a benchmark exercise the translate path without network access.
+An optional per-call delay (BENCH_TRANSLATE_DELAY_MS) models the real RTT.
+"""
+import os
+import re
+import time
+
+_TAG = re.compile(r"^\[([a-z]{2})\]\s*")
+
+
+class _Detected:
+    def __init__(self, lang: str):
+        self.lang = lang
+        self.confidence = 1.0
+
+
+class _Translated:
+    def __init__(self, text: str, src: str, dest: str):
+        self.text = text
+        self.src = src
+        self.dest = dest
+
+
+class StubTranslator:
+    delay = float(os.getenv("BENCH_TRANSLATE_DELAY_MS", "0")) / 1000.0
+
+    def _wait(self):
+        if self.delay:
+            time.sleep(self.delay)
+
+    def detect(self, text: str):
+        self._wait()
+        m = _TAG.match(text or "")
+        return _Detected(m.group(1) if m else "en")
+
+    def translate(self, text: str, dest: str = "en", src: str = "auto"):
+        self._wait()
+        return _Translated(_TAG.sub("", text or ""), src, dest)
@@ -0,0 +1,281 @@
+"""Embedding service shared by ingestion, retrieval and attachments.
+
+- Model: all-MiniLM-L6-v2 by default, the same one Chroma uses. Any other
+  model needs EMBED_ONNX_PATH, an ONNX export directory (model +
+  tokenizer.json); EMBED_ONNX_FILE selects the file inside it, e.g.
+  `model_quantized.onnx` for an int8 variant. The model id (directory name
+  and file) is derived from what was loaded; a setting that can't be
+  honoured fails at startup instead of quietly using MiniLM.
+- Throughput: EMBED_BATCH_SIZE texts per inference call and
+  EMBED_THREADS intra-op threads for onnxruntime.
+- Disk cache: vectors are appended to a float32 file that is memory-mapped
+  for reads, and indexed in SQLite by sha256(text) per model id. Re-ingests
+  and repeated texts skip inference entirely, across restarts and workers.
+- Query cache: retrieval queries are cached in an in-process LRU
+  (EMBED_QUERY_CACHE_SIZE) only; user text never reaches the disk cache.
+
+Changing the model changes the vector space: rebuild the collection with
+ingest_chroma.py afterwards.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+from chromadb.utils import embedding_functions
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+MODEL_NAME = os.getenv("EMBED_MODEL", DEFAULT_MODEL)
+ONNX_PATH = os.getenv("EMBED_ONNX_PATH", "")
+ONNX_FILE = os.getenv("EMBED_ONNX_FILE", "model.onnx")
+BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+THREADS = int(os.getenv("EMBED_THREADS", "0"))  # 0 = onnxruntime default
+MAX_TOKENS = int(os.getenv("EMBED_MAX_TOKENS", "256"))
+CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "embedding_cache")
+QUERY_CACHE_SIZE = int(os.getenv("EMBED_QUERY_CACHE_SIZE", "2048"))
+
+
+def _text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class OnnxEmbedder:
+    """Mean-pooled, L2-normalised sentence embeddings from an ONNX transformer export."""
+
+    def __init__(self, model_dir: str, model_file: str = ONNX_FILE, threads: int = THREADS,
+                 batch_size: int = BATCH_SIZE, max_tokens: int = MAX_TOKENS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = Path(model_dir)
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_tokens)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+        options = ort.SessionOptions()
+        options.log_severity_level = 3
+        if threads > 0:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            str(model_dir / model_file), options, providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.batch_size = batch_size
+
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        out = []
+        for offset in range(0, len(texts), self.batch_size):
+            encoded = self.tokenizer.encode_batch(texts[offset:offset + self.batch_size])
+            ids = np.array([e.ids for e in encoded], dtype=np.int64)
+            mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+            feed = {"input_ids": ids, "attention_mask": mask}
+            if "token_type_ids" in self.input_names:
+                feed["token_type_ids"] = np.zeros_like(ids)
+            hidden = self.session.run(None, {k: v for k, v in feed.items() if k in self.input_names})[0]
+            weights = mask[..., None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            out.append((pooled / np.clip(norms, 1e-12, None)).astype(np.float32))
+        return np.vstack(out) if out else np.zeros((0, 0), dtype=np.float32)
+
+
+def _default_model_dir() -> Path | None:
+    """Where Chroma keeps its bundled MiniLM export, downloading it on first use."""
+    onnx_cls = embedding_functions.ONNXMiniLM_L6_V2
+    model_dir = Path(onnx_cls.DOWNLOAD_PATH) / onnx_cls.EXTRACTED_FOLDER_NAME
+    if not (model_dir / "model.onnx").exists():
+        onnx_cls()(["warm up"])
+    return model_dir if (model_dir / "model.onnx").exists() else None
+
+
+def load_backend():
+    """Returns (model_id, embed callable); the id names the model actually loaded.
+
+    A model that can't be loaded as configured is an error, not a silent switch
+    to MiniLM: the id keys the vector cache and tags cached attachments.
+    """
+    if ONNX_PATH:
+        return f"{Path(ONNX_PATH).resolve().name}:{ONNX_FILE}", OnnxEmbedder(ONNX_PATH)
+    if MODEL_NAME != DEFAULT_MODEL:
+        raise RuntimeError(
+            f"EMBED_MODEL={MODEL_NAME} needs EMBED_ONNX_PATH pointing at its ONNX export; "
+            f"only {DEFAULT_MODEL} ships with Chroma"
+        )
+    try:
+        model_dir = _default_model_dir()
+    except Exception as e:
+        print(f"[backend] Chroma's {DEFAULT_MODEL} export unavailable: {e}")
+        model_dir = None
+    # The fallback below can only run the plain model.onnx
+    has_file = (model_dir / ONNX_FILE).exists() if model_dir is not None else ONNX_FILE == "model.onnx"
+    if not has_file:
+        raise RuntimeError(
+            f"EMBED_ONNX_FILE={ONNX_FILE} is not in Chroma's {DEFAULT_MODEL} export; "
+            "set EMBED_ONNX_PATH to a directory that has it"
+        )
+    if model_dir is not None:
+        try:
+            return f"{DEFAULT_MODEL}:{ONNX_FILE}", OnnxEmbedder(str(model_dir))
+        except Exception as e:
+            print(f"[backend] Falling back to Chroma's default embedder: {e}")
+    # Same MiniLM model, run by Chroma instead of our batched session
+    default = embedding_functions.DefaultEmbeddingFunction()
+    return f"{DEFAULT_MODEL}:chroma-default", lambda texts: np.asarray(default(texts), dtype=np.float32)
+
+
+class EmbeddingCache:
+    """Append-only float32 vector file (memory-mapped for reads) plus a SQLite index.
+
+    Appends take an flock on the vector file, so several workers can share one cache.
+    """
+
+    def __init__(self, directory: str, model_id: str):
+        self.dir = Path(directory) / re.sub(r"[^A-Za-z0-9_.-]+", "_", model_id)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.dir / "vectors.f32"
+        self.vectors_path.touch(exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.dir / "index.sqlite3"), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS rows (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.commit()
+        row = self._db.execute("SELECT value FROM meta WHERE name='dim'").fetchone()
+        self.dim = int(row[0]) if row else None
+        self._map = None
+
+    def _mapped(self, needed_rows: int):
+        if self._map is None or self._map.shape[0] < needed_rows:
+            rows = os.path.getsize(self.vectors_path) // (self.dim * 4)
+            self._map = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return self._map
+
+    def get_many(self, keys: list[str]) -> dict:
+        if not keys or self.dim is None:
+            return {}
+        found = {}
+        with self._lock:
+            for offset in range(0, len(keys), 500):
+                batch = keys[offset:offset + 500]
+                placeholders = ",".join("?" * len(batch))
+                found.update(self._db.execute(
+                    f"SELECT key, row FROM rows WHERE key IN ({placeholders})", batch,
+                ).fetchall())
+            if not found:
+                return {}
+            vectors = self._mapped(max(found.values()) + 1)
+            return {key: np.array(vectors[row]) for key, row in found.items()}
+
+    def put_many(self, items: dict):
+        if not items:
+            return
+        matrix = np.asarray(list(items.values()), dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(matrix.shape[1])
+                self._db.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('dim', ?)", (str(self.dim),))
+            with open(self.vectors_path, "ab") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0, os.SEEK_END)
+                    first_row = f.tell() // (self.dim * 4)
+                    f.write(matrix.tobytes())
+                    f.flush()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO rows (key, row) VALUES (?, ?)",
+                [(key, first_row + i) for i, key in enumerate(items)],
+            )
+            self._db.commit()
+
+
+class EmbeddingService(EmbeddingFunction):
+    """Chroma-compatible embedding function with disk and query caches."""
+
+    def __init__(self, model_id: str | None = None, backend=None, cache_dir: str = CACHE_DIR,
+                 query_cache_size: int = QUERY_CACHE_SIZE):
+        if backend is None:
+            model_id, backend = load_backend()
+        self.model_id = model_id
+        self._backend = backend
+        self._cache = EmbeddingCache(cache_dir, model_id) if cache_dir else None
+        self._queries = OrderedDict()
+        self._query_cache_size = query_cache_size
+        self._query_lock = threading.Lock()
+
+    def __call__(self, input):
+        return [[float(x) for x in v] for v in self.embed(list(input))]
+
+    def embed(self, texts: list[str], cache: bool = True) -> list[np.ndarray]:
+        if not texts:
+            return []
+        if not cache or self._cache is None:
+            with metrics.stage("embed"):
+                return list(self._backend(texts))
+        keys = [_text_key(t) for t in texts]
+        cached = self._cache.get_many(list(set(keys)))
+        metrics.CACHE_EVENTS.inc(len(cached), cache="embedding", result="hit")
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            metrics.CACHE_EVENTS.inc(len(missing), cache="embedding", result="miss")
+            with metrics.stage("embed"):
+                vectors = self._backend(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self._cache.put_many(fresh)
+            cached.update(fresh)
+        return [cached[key] for key in keys]
+
+    def embed_uncached(self, texts: list[str]) -> list[np.ndarray]:
+        """For one-off texts (e.g. log excerpts) that would only bloat the disk cache."""
+        return self.embed(texts, cache=False)
+
+    def query_vector(self, text: str) -> list[float]:
+        with self._query_lock:
+            vector = self._queries.get(text)
+            if vector is not None:
+                self._queries.move_to_end(text)
+        if vector is not None:
+            metrics.CACHE_EVENTS.inc(cache="query_embedding", result="hit")
+            return vector
+        metrics.CACHE_EVENTS.inc(cache="query_embedding", result="miss")
+        # Queries are user text: keep them in memory only, the disk cache would grow forever
+        vector = [float(x) for x in self.embed([text], cache=False)[0]]
+        with self._query_lock:
+            self._queries[text] = vector
+            while len(self._queries) > self._query_cache_size:
+                self._queries.popitem(last=False)
+        return vector
+
+    def query_vectors(self, texts: list[str]) -> list[list[float]]:
+        return [self.query_vector(t) for t in texts]
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service() -> EmbeddingService:
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = EmbeddingService()
+    return _service
@@ -0,0 +1,83 @@
+"""Precomputed answers for frequent prompts, consulted before generating.
+
+`python batch.py faq_prompts.jsonl --faq faq_answers.json` runs a prompt list
+through the answer pipeline in every style and writes this table. Entries
+are keyed exactly like the shared answer cache (main._answer_cache_key:
+normalised English prompt, style, the retrieved context, the model and
+the prompt templates), so an entry only matches while retrieval still
+returns the context it was generated from; after a knowledge-base, model
+or prompt change that affects a question, the entry simply stops matching
+until the batch is rerun.
+
+The table is a JSON file (FAQ_ANSWERS_PATH). Workers re-read it when it
+changes, checking at most every FAQ_ANSWERS_CHECK_SECONDS, so a new table
+takes effect without a restart. A missing file means an empty table.
+"""
+import json
+import os
+import threading
+import time
+
+import metrics
+
+PATH = os.getenv("FAQ_ANSWERS_PATH", "faq_answers.json")
+CHECK_INTERVAL_SECONDS = float(os.getenv("FAQ_ANSWERS_CHECK_SECONDS", "5"))
+
+
+class FaqTable:
+    def __init__(self, path: str = PATH):
+        self.path = path
+        self._entries = {}
+        self._mtime = None
+        self._checked = float("-inf")
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked < CHECK_INTERVAL_SECONDS:
+            return
+        with self._lock:
+            if now - self._checked < CHECK_INTERVAL_SECONDS:
+                return
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                self._entries, self._mtime = {}, None
+                return
+            if mtime == self._mtime:
+                return
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                # Keep serving the previous table rather than none
+                print(f"[backend] FAQ answers {self.path} unreadable: {e}")
+                return
+            self._entries = {entry["key"]: entry["answer"] for entry in data.get("entries", [])}
+            self._mtime = mtime
+            print(f"[backend] Loaded {len(self._entries)} precomputed answers from {self.path}")
+
+    def get(self, key: str) -> str | None:
+        self._refresh()
+        answer = self._entries.get(key)
+        if self._entries:
+            metrics.CACHE_EVENTS.inc(cache="faq", result="miss" if answer is None else "hit")
+        return answer
+
+    def __len__(self):
+        self._refresh()
+        return len(self._entries)
+
+
+def write(path: str, entries: list[dict], meta: dict | None = None):
+    """Atomically replace the table at `path`. Each entry needs `key` and `answer`."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({**(meta or {}), "entries": entries}, f, ensure_ascii=False, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+answers = FaqTable()
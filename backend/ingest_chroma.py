@@ -18,15 +18,22 @@
 # print(f"✅ Added {filename} to ChromaDB!")
 
 
+import argparse
+import hashlib
+import re
+
 import chromadb
-from chromadb.utils import embedding_functions
 
-# --- Load knowledge base ---
-with open("knowledge_base.txt", "r", encoding="utf-8") as f:
-    text = f.read()
+import embeddings
+import vector_store
+
+KB_PATH = "knowledge_base.txt"
+COLLECTION_NAME = vector_store.ALIAS
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
 
 # --- Chunking ---
-def chunk_text(text, chunk_size=500, overlap=50):
+def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
     chunks = []
     start = 0
     while start < len(text):
@@ -35,36 +42,81 @@ def chunk_text(text, chunk_size=500, overlap=50):
         start += chunk_size - overlap
     return chunks
 
-chunks = chunk_text(text)
-
-# --- Initialize ChromaDB ---
-client = chromadb.PersistentClient(path="chroma_db")
-
-embedding_func = embedding_functions.DefaultEmbeddingFunction()
-collection = client.get_or_create_collection(
-    name="cybersecurity",
-    embedding_function=embedding_func
-)
-
-try:
-    client.delete_collection("cybersecurity")
-    print("✅ Old collection deleted.")
-except Exception as e:
-    print("ℹ️ No old collection to delete:", e)
-
-# Recreate it
-collection = client.get_or_create_collection(
-    name="cybersecurity",
-    embedding_function=embedding_func
-)
-
-# --- Insert chunks ---
-for i, chunk in enumerate(chunks):
-    collection.add(
-        ids=[f"doc_{i}"],
-        documents=[chunk],
-        metadatas=[{"source": "knowledge_base.txt", "chunk": i}]
-    )
-
-print(f"Inserted {len(chunks)} chunks into ChromaDB.")
-print("Sample chunk:", chunks[0][:200], "...")
+def chunk_document(text, source=KB_PATH, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Split into blank-line separated sections, then into overlapping chunks within each section.
+
+    Returns (id, text, metadata) records. Ids derive from the section's content, so an edit only
+    changes the ids of the section it touches -- which is what lets kb_watcher upsert deltas.
+    """
+    records = []
+    seen = {}
+    sections = [s.strip() for s in re.split(r"\n\s*\n", text.replace("\r\n", "\n")) if s.strip()]
+    for section in sections:
+        digest = hashlib.sha1(section.encode("utf-8")).hexdigest()[:16]
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        key = digest if occurrence == 0 else f"{digest}-{occurrence}"
+        for j, chunk in enumerate(chunk_text(section, chunk_size, overlap)):
+            metadata = {"source": source, "section": key, "chunk": j, "overlap": overlap}
+            records.append((f"{source}:{key}:{j}", chunk, metadata))
+    return records
+
+def load_chunks(path=KB_PATH):
+    with open(path, "r", encoding="utf-8") as f:
+        return chunk_document(f.read(), source=path)
+
+def ingest(client, chunks, name=COLLECTION_NAME, embedding_func=None, batch_size=64, replace=True):
+    """Build collection `name` from chunk records (dropping it first if `replace`). Returns the collection."""
+    # Shared, disk-cached embedder: unchanged chunks are not re-embedded on rebuilds
+    embedding_func = embedding_func or embeddings.get_service()
+    if replace:
+        try:
+            client.delete_collection(name)
+            print("✅ Old collection deleted.")
+        except Exception as e:
+            print("ℹ️ No old collection to delete:", e)
+
+    collection = client.get_or_create_collection(name=name, embedding_function=embedding_func)
+
+    # --- Insert chunks (batched: one embedding call per batch) ---
+    for offset in range(0, len(chunks), batch_size):
+        batch = chunks[offset:offset + batch_size]
+        collection.add(
+            ids=[record[0] for record in batch],
+            documents=[record[1] for record in batch],
+            metadatas=[record[2] for record in batch],
+        )
+    return collection
+
+def build_and_promote(client, chunks, alias=COLLECTION_NAME, promote=True, keep=vector_store.KEEP_VERSIONS):
+    """Blue/green rebuild: ingest into a new version, smoke-test it, then swap the alias.
+
+    The live collection keeps serving throughout; a failed build is deleted and never promoted.
+    """
+    name = vector_store.next_version_name(client, alias)
+    print(f"Building {name} ...")
+    collection = ingest(client, chunks, name=name, replace=False)
+    problems = vector_store.validate(collection, len(chunks))
+    if problems:
+        client.delete_collection(name)
+        raise RuntimeError(f"Validation of {name} failed: " + "; ".join(problems))
+    if promote:
+        vector_store.promote(name, alias, client=client)
+        print(f"✅ Promoted {name} (alias '{alias}').")
+        deleted = vector_store.gc(client, alias, keep=keep)
+        if deleted:
+            print("🧹 Removed old versions:", ", ".join(deleted))
+    return name
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the knowledge-base collection without downtime.")
+    parser.add_argument("--no-promote", action="store_true", help="build and validate, but leave the alias alone")
+    parser.add_argument("--keep", type=int, default=vector_store.KEEP_VERSIONS, help="previous versions to keep")
+    args = parser.parse_args()
+
+    chunks = load_chunks()
+    client = chromadb.PersistentClient(path=vector_store.CHROMA_PATH)
+    build_and_promote(client, chunks, promote=not args.no_promote, keep=args.keep)
+
+    print(f"Inserted {len(chunks)} chunks into ChromaDB.")
+    print("Sample chunk:", chunks[0][1][:200], "...")
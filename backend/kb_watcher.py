@@ -0,0 +1,127 @@
+"""Optional hot reload of the knowledge base (enable with KB_WATCH=1).
+
+A daemon thread polls the knowledge-base files (KB_WATCH_PATHS, comma
+separated). Once a file has stopped changing for KB_WATCH_DEBOUNCE_SECONDS,
+it is re-chunked with ingest_chroma.chunk_document. Chunk ids are derived
+from section content, so only sections that were added or edited get
+embedded and upserted into the live collection, and vanished sections are
+deleted. Callbacks registered with `on_reload` run after every applied
+change, which is how answer caches get invalidated.
+
+Polling is used instead of inotify so it behaves the same on every OS and
+on network mounts; a stat() per file per interval is negligible. Run the
+watcher in one worker only: the upserts are idempotent, but every extra
+watcher repeats the embedding work.
+"""
+import os
+import threading
+import time
+
+import metrics
+from ingest_chroma import chunk_document
+
+WATCH_ENABLED = os.getenv("KB_WATCH", "").strip().lower() in {"1", "true", "yes", "on"}
+WATCH_PATHS = [p.strip() for p in os.getenv("KB_WATCH_PATHS", "knowledge_base.txt").split(",") if p.strip()]
+POLL_SECONDS = float(os.getenv("KB_WATCH_POLL_SECONDS", "1"))
+DEBOUNCE_SECONDS = float(os.getenv("KB_WATCH_DEBOUNCE_SECONDS", "2"))
+
+KB_RELOADS = metrics.REGISTRY.register(metrics.Counter(
+    "securum_kb_reloads_total", "Knowledge-base hot reloads by outcome.", ("result",),
+))
+KB_CHUNKS = metrics.REGISTRY.register(metrics.Counter(
+    "securum_kb_chunks_total", "Chunks changed by hot reloads.", ("op",),
+))
+
+_callbacks = []
+
+
+def on_reload(callback):
+    """Register `callback(source)` to run after a knowledge-base change is applied."""
+    _callbacks.append(callback)
+    return callback
+
+
+def sync_source(collection, path: str) -> tuple[int, int]:
+    """Bring `collection` in line with the file at `path`. Returns (upserted, deleted)."""
+    with open(path, "r", encoding="utf-8") as f:
+        records = chunk_document(f.read(), source=path)
+    wanted = {record[0]: record for record in records}
+    existing = set(collection.get(where={"source": path}, include=[])["ids"])
+
+    added = [wanted[i] for i in wanted if i not in existing]
+    removed = [i for i in existing if i not in wanted]
+    if added:
+        collection.upsert(
+            ids=[r[0] for r in added],
+            documents=[r[1] for r in added],
+            metadatas=[r[2] for r in added],
+        )
+    if removed:
+        collection.delete(ids=removed)
+    return len(added), len(removed)
+
+
+class KnowledgeBaseWatcher(threading.Thread):
+    def __init__(self, collection_handle, paths=None, poll=POLL_SECONDS, debounce=DEBOUNCE_SECONDS):
+        super().__init__(name="kb-watcher", daemon=True)
+        self.collection_handle = collection_handle
+        self.paths = list(paths or WATCH_PATHS)
+        self.poll = poll
+        self.debounce = debounce
+        self._stop_event = threading.Event()
+        self._seen = {path: self._signature(path) for path in self.paths}
+        self._pending = {}  # path -> monotonic time of the last observed change
+
+    @staticmethod
+    def _signature(path):
+        try:
+            st = os.stat(path)
+            return st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        print(f"[backend] Watching knowledge base: {', '.join(self.paths)}")
+        while not self._stop_event.wait(self.poll):
+            now = time.monotonic()
+            for path in self.paths:
+                signature = self._signature(path)
+                if signature != self._seen.get(path):
+                    self._seen[path] = signature
+                    self._pending[path] = now
+            for path, changed_at in list(self._pending.items()):
+                if now - changed_at >= self.debounce:
+                    del self._pending[path]
+                    self._apply(path)
+
+    def _apply(self, path):
+        if not os.path.exists(path):
+            print(f"[backend] Knowledge-base file {path} disappeared; keeping its chunks.")
+            return
+        try:
+            with metrics.stage("kb_reload"):
+                upserted, deleted = sync_source(self.collection_handle.get(), path)
+        except Exception as e:
+            KB_RELOADS.inc(result="error")
+            print(f"[backend] Knowledge-base reload of {path} failed: {e}")
+            return
+        KB_RELOADS.inc(result="applied" if upserted or deleted else "unchanged")
+        KB_CHUNKS.inc(upserted, op="upsert")
+        KB_CHUNKS.inc(deleted, op="delete")
+        if not (upserted or deleted):
+            return
+        print(f"[backend] Reloaded {path}: {upserted} chunk(s) upserted, {deleted} deleted.")
+        for callback in list(_callbacks):
+            try:
+                callback(path)
+            except Exception as e:
+                print(f"[backend] Knowledge-base reload callback failed: {e}")
+
+
+def start(collection_handle) -> KnowledgeBaseWatcher:
+    watcher = KnowledgeBaseWatcher(collection_handle)
+    watcher.start()
+    return watcher
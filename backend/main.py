@@ -6,16 +6,20 @@ load_dotenv()
 # STEP 2: Import all libraries
 import os
 import json
+import asyncio
 import io
 import csv
+import time
+import functools
 from googletrans import Translator
 from docx import Document
 from fpdf import FPDF
 from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request, Body, Depends
 app = FastAPI()
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 import chromadb
 import requests
 import psycopg2
@@ -23,40 +27,34 @@ from psycopg2 import pool
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
 from typing import Optional
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
 from pathlib import Path
 import re
+import metrics
+import attachments
+import sse
+import singleflight
+import pipeline
+import retrieval
+import vector_store
+import kb_watcher
+import embeddings
+import schema
+import retention
+import auth
+import shared_cache
+import retrieval_sidecar
+import ratelimit
+import faq
 
 # =========================
 # CONFIG
 # =========================
-OLLAMA_API_URL = "http://localhost:11434/api/chat"
-MODEL_NAME = "llama3.2:3b"
+OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/chat")
+MODEL_NAME = os.getenv("OLLAMA_MODEL", "llama3.2:3b")
 GOOGLE_CLIENT_ID = "226312071852-bpt8lnl56pkh0uf544bu3ufk604fms9r.apps.googleusercontent.com"
 
-from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
-
-def _sanitize_dsn(dsn: str) -> str:
-    """Drop query params psycopg2 doesn't understand (e.g., pgbouncer=true)."""
-    try:
-        parsed = urlparse(dsn)
-        q = dict(parse_qsl(parsed.query, keep_blank_values=True))
-        # Remove Node/Prisma-specific flag that psycopg2 can't parse
-        q.pop("pgbouncer", None)
-        new_query = urlencode(q)
-        return urlunparse(parsed._replace(query=new_query))
-    except Exception:
-        return dsn
-
 # Gather DB candidates (in a resilient order) and try until one works.
-env_candidates = []
-if os.getenv("PY_DATABASE_URL"):
-    env_candidates.append(("PY_DATABASE_URL", os.getenv("PY_DATABASE_URL")))
-if os.getenv("DATABASE_URL"):
-    env_candidates.append(("DATABASE_URL", os.getenv("DATABASE_URL")))
-if os.getenv("DIRECT_URL"):
-    env_candidates.append(("DIRECT_URL", os.getenv("DIRECT_URL")))
+env_candidates = schema.database_urls()
 
 if not env_candidates:
     raise EnvironmentError("No database URL found. Set PY_DATABASE_URL or DATABASE_URL or DIRECT_URL")
@@ -64,12 +62,14 @@ if not env_candidates:
 last_err = None
 db_pool = None
 for name, raw in env_candidates:
-    dsn = _sanitize_dsn(raw)
+    dsn = schema.sanitize_dsn(raw)
     try:
         # Quick connectivity probe to catch DNS issues early
         test_conn = psycopg2.connect(dsn)
         test_conn.close()
-        db_pool = pool.SimpleConnectionPool(1, 20, dsn=dsn, cursor_factory=RealDictCursor)
+        db_pool = pool.SimpleConnectionPool(
+            1, 20, dsn=dsn, cursor_factory=RealDictCursor, connection_factory=schema.connection_factory(raw),
+        )
         print(f"[backend] Connected to DB via {name}")
         break
     except Exception as e:
@@ -79,18 +79,95 @@ for name, raw in env_candidates:
 if db_pool is None:
     raise last_err or EnvironmentError("Failed to initialize database pool")
 
-chroma_client = chromadb.PersistentClient(path="chroma_db")
-collection = chroma_client.get_or_create_collection(name="cybersecurity")
+# Create/upgrade the chat tables and their indexes once at startup (see schema.py)
+if os.getenv("SCHEMA_MIGRATE", "1").strip().lower() not in {"0", "false", "no", "off"}:
+    _conn = db_pool.getconn()
+    try:
+        for _name in schema.migrate(_conn):
+            print(f"[backend] Applied schema migration: {_name}")
+        if schema.relation_kind(_conn, "chat_messages") == "r":
+            print("[backend] chat_messages is not partitioned yet: run `python retention.py --convert` (see retention.py)")
+        for _name in schema.ensure_partitions(_conn):
+            print(f"[backend] Created partition {_name}")
+    except Exception as e:
+        print(f"[backend] Schema migration failed: {e}")
+    finally:
+        db_pool.putconn(_conn)
+
+def _db_pool_stats():
+    used = len(getattr(db_pool, "_used", {}))
+    idle = len(getattr(db_pool, "_pool", []))
+    return {("in_use",): used, ("idle",): idle, ("max",): db_pool.maxconn}
+
+metrics.DB_POOL.set_function(_db_pool_stats)
+
+if retrieval_sidecar.SOCKET_PATH:
+    # Multi-worker mode: one sidecar process owns Chroma, the model and the KB watcher
+    retriever = retrieval_sidecar.RetrievalClient(retrieval_sidecar.SOCKET_PATH)
+    print(f"[backend] Using retrieval sidecar at {retrieval_sidecar.SOCKET_PATH}")
+else:
+    chroma_client = chromadb.PersistentClient(path=vector_store.CHROMA_PATH)
+    # Configurable model with on-disk and query-embedding caches (see embeddings.py)
+    embedder = embeddings.get_service()
+    # Resolves the `cybersecurity` alias and follows promotions made by ingest_chroma.py
+    collection_handle = vector_store.CollectionHandle(chroma_client, embedder)
+    retriever = retrieval_sidecar.LocalRetriever(collection_handle, embedder)
+    if kb_watcher.WATCH_ENABLED:
+        kb_watcher.on_reload(lambda _source: shared_cache.answers.clear())
+        kb_watcher.start(collection_handle)
+attachment_store = attachments.AttachmentStore()
+stream_registry = sse.StreamRegistry()
+answer_flight = singleflight.SingleFlight("answer")
+stream_flight = singleflight.SingleFlight("stream")
+retrieval_flight = singleflight.SingleFlight("retrieval")
 
 app = FastAPI()
+
+# Registered before CORS so the 413 still carries CORS headers
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Refuse oversized uploads from Content-Length, before Starlette receives and spools the body."""
+    if request.method == "POST" and request.url.path == "/chat/message":
+        length = request.headers.get("content-length", "")
+        if length.isdigit() and int(length) > attachments.MAX_UPLOAD_BYTES + attachments.FORM_OVERHEAD_BYTES:
+            limit_mb = attachments.MAX_UPLOAD_BYTES // (1024 * 1024)
+            return JSONResponse(status_code=413, content={"detail": f"Attachment exceeds the {limit_mb} MB limit."})
+    return await call_next(request)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "X-Session-Id", "X-Stream-Id", "Server-Timing", "Retry-After",
+        "X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset", "X-Quota-Limit", "X-Quota-Remaining",
+    ],
 )
 
+TRACE_HEADER = "x-trace"
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """Time every request; with `X-Trace: 1` also return the stage breakdown."""
+    trace = metrics.start_trace()
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.REQUEST_SECONDS.observe(
+        time.perf_counter() - started,
+        route=getattr(route, "path", "unmatched"),
+        method=request.method,
+        status=response.status_code,
+    )
+    if request.headers.get(TRACE_HEADER):
+        response.headers["Server-Timing"] = metrics.format_server_timing(trace)
+    # Usage headers from ratelimit.enforce, on requests it let through
+    for name, value in getattr(request.state, "rate_limit_headers", {}).items():
+        response.headers[name] = value
+    return response
+
 # =========================
 # MODELS
 # =========================
@@ -126,16 +203,32 @@ def get_db_connection():
         if conn:
             db_pool.putconn(conn)
 
-def retrieve_context(query: str, n_results: int = 3) -> str:
+def _session_messages(cursor, session_id: int) -> list:
+    """Live messages plus any that retention.py moved to the archive, oldest first."""
+    schema.execute(cursor, "list_messages", (session_id,))
+    rows = cursor.fetchall()
+    archived = retention.load_archived(cursor, session_id)
+    if archived:
+        rows = sorted(archived + list(rows), key=lambda r: r["created_at"])
+    return rows
+
+def retrieve_context(query: str, n_results: int = retrieval.OVERFETCH) -> str:
+    """Over-fetch from Chroma and reduce the hits to a packed, relevance-filtered context.
+
+    Returns an empty string when nothing is close enough to be useful.
+    """
     try:
-        results = collection.query(query_texts=[query], n_results=n_results)
-        if results and "documents" in results and results["documents"]:
-            retrieved_docs = [doc for docs in results["documents"] for doc in docs]
-            context = "\n\n".join(retrieved_docs)
-            return context.strip()
+        with metrics.stage("retrieve"):
+            results = retriever.query(query, n_results)
+        with metrics.stage("retrieve_post"):
+            return retrieval.build_context(query, results)
     except Exception as e:
         print(f"❌ Error querying ChromaDB: {e}")
-    return "No relevant context found."
+    return ""
+
+def _context_section(context: str) -> str:
+    """The prompt's context block; omitted entirely when retrieval found nothing relevant."""
+    return f"\n\n--- Relevant Context ---\n{context}" if context else ""
 
 def _is_greeting(text: str) -> bool:
     """Detect simple greeting-only inputs like 'hi', 'hello', 'good morning'."""
@@ -183,18 +276,47 @@ def _style_instructions(style: str | None) -> str:
     )
 
 
-def call_llm(prompt: str, history: list[dict] | None = None, style: str | None = None) -> str:
-    """Gets a single, complete response from the LLM with translation."""
-    english_prompt, source_lang = _translate(prompt, 'en')
+def _retrieve_shared(query: str) -> str:
+    """retrieve_context, with concurrent identical queries sharing one Chroma lookup."""
+    return retrieval_flight.do(query, lambda: retrieve_context(query))
 
-    # Short-circuit for simple greetings
-    if _is_greeting(english_prompt):
-        english_answer = "Hello! How can I help you with cybersecurity today?"
-        final_answer, _ = _translate(english_answer, source_lang)
-        return final_answer
+def _start_turn(prompt: str, extra_stages: dict | None = None) -> pipeline.PipelineRun:
+    """Kick off the pre-LLM stages for one turn.
 
-    context = retrieve_context(english_prompt)
-    system_prompt = (
+    Stage graph:
+        detect ─────────► translate ──┐
+        retrieve_raw (speculative) ───┴─► retrieve
+        <extra stages, e.g. db_setup>   (independent)
+
+    Retrieval starts on the raw prompt while the language is being detected;
+    if the prompt turns out to be English already, that result is used as-is.
+    """
+    def retrieve_raw():
+        if _is_greeting(prompt):
+            return None
+        return _retrieve_shared(prompt)
+
+    def retrieve(translate, retrieve_raw):
+        if _is_greeting(translate):
+            return ""
+        if translate == prompt and retrieve_raw is not None:
+            metrics.CACHE_EVENTS.inc(cache="speculative_retrieval", result="hit")
+            return retrieve_raw
+        metrics.CACHE_EVENTS.inc(cache="speculative_retrieval", result="miss")
+        return _retrieve_shared(translate)
+
+    graph = pipeline.StageGraph()
+    graph.add("detect", lambda: _detect_language(prompt))
+    graph.add("retrieve_raw", retrieve_raw)
+    graph.add("translate", lambda detect: _translate_text(prompt, "en", detect), deps=("detect",))
+    graph.add("retrieve", retrieve, deps=("translate", "retrieve_raw"))
+    for name, fn in (extra_stages or {}).items():
+        graph.add(name, fn)
+    return graph.run()
+
+def _system_prompt(context: str, style: str | None, decline_off_topic: bool = False) -> str:
+    """The system message for an answer; everything in it but `context` is covered by _prompt_version."""
+    return (
         "You are a professional cybersecurity assistant. "
         "Write in plain text with minimal Markdown ONLY for code blocks and blockquotes. Do NOT use heading markers (# or ##). Do NOT use asterisks (*) for bold/italics. Keep sentences short and place each sentence on its own line. Leave a blank line between sections.\n\n"
         "Start with a single TITLE line that states the topic . No markup.\n"
@@ -213,9 +335,87 @@ def call_llm(prompt: str, history: list[dict] | None = None, style: str | None =
         "- Links or document names.\n\n"
         f"{_style_instructions(style)}\n"
         "Always ground answers in the relevant context below when helpful. Prefer concrete actions over theory."
-        "if the question if unrelated to cybersecurity, politely inform the user that you are specialized in cybersecurity topics and cannot assist with their query."
-        f"\n\n--- Relevant Context ---\n{context}"
+        + ("if the question if unrelated to cybersecurity, politely inform the user that you are specialized in cybersecurity topics and cannot assist with their query." if decline_off_topic else "")
+        + _context_section(context)
     )
+
+# Styles come from requests: bounded, though only the four known ones recur
+@functools.lru_cache(maxsize=64)
+def _prompt_version(style: str | None) -> str:
+    """Identifies the model and both prompt templates for `style`: cached answers from another don't match."""
+    return shared_cache.digest(MODEL_NAME, _system_prompt("", style, True), _system_prompt("", style, False))
+
+def _answer_cache_key(english_prompt: str, style: str | None, context: str) -> str:
+    """Answers depend on the question, the style, what retrieval found, the model and the prompt templates."""
+    return shared_cache.digest(singleflight.make_key(english_prompt, style), context, _prompt_version(style))
+
+def _lookup_answer(cache_key: str) -> tuple[str | None, str | None]:
+    """A precomputed FAQ answer, else a cached one. Returns (answer, "faq"/"cache"), or (None, None)."""
+    answer = faq.answers.get(cache_key)
+    if answer is not None:
+        metrics.FAST_PATH.inc(path="faq")
+        return answer, "faq"
+    answer = shared_cache.answers.get(cache_key)
+    return (answer, "cache") if answer is not None else (None, None)
+
+def answer_turn(prompt: str, history: list[dict] | None = None, style: str | None = None, use_cache: bool = True) -> dict:
+    """Run the full non-streaming pipeline for one prompt and report what each step produced.
+
+    Keys: answer, english_answer, english_prompt, source_lang, context, cache_key
+    (None when not cacheable), source ("greeting", "faq", "cache", "llm" or
+    "error") and error. `use_cache=False` skips the FAQ table and
+    answer cache, so the answer is always generated (batch.py).
+    """
+    turn = _start_turn(prompt)
+    source_lang = turn.result("detect")
+    english_prompt = turn.result("translate")
+    result = {
+        "english_prompt": english_prompt, "source_lang": source_lang, "context": "", "cache_key": None, "error": None,
+    }
+
+    # Short-circuit for simple greetings
+    if _is_greeting(english_prompt):
+        metrics.FAST_PATH.inc(path="greeting")
+        english_answer = "Hello! How can I help you with cybersecurity today?"
+        return dict(
+            result, answer=_translate_text(english_answer, source_lang, "en"), english_answer=english_answer,
+            source="greeting",
+        )
+
+    try:
+        context = result["context"] = turn.result("retrieve")
+        source = "llm"
+        if history:
+            english_answer = _generate_english(english_prompt, context, history, style)
+        else:
+            cache_key = result["cache_key"] = _answer_cache_key(english_prompt, style, context)
+            english_answer, source = _lookup_answer(cache_key) if use_cache else (None, None)
+            if english_answer is None:
+                source = "llm"
+                # Concurrent duplicates of this question share one generation
+                english_answer = answer_flight.do(
+                    singleflight.make_key(english_prompt, style),
+                    lambda: _generate_english(english_prompt, context, None, style),
+                )
+                if english_answer:
+                    shared_cache.answers.set(cache_key, english_answer)
+        return dict(
+            result, answer=_translate_text(english_answer, source_lang, "en"), english_answer=english_answer,
+            source=source,
+        )
+    except Exception as e:
+        print(f"Error calling local Ollama LLM: {e}")
+        return dict(
+            result, answer="Sorry, I couldn't process your request.", english_answer=None, source="error", error=str(e),
+        )
+
+def call_llm(prompt: str, history: list[dict] | None = None, style: str | None = None) -> str:
+    """Gets a single, complete response from the LLM with translation."""
+    return answer_turn(prompt, history, style)["answer"]
+
+def _generate_english(english_prompt: str, context: str, history: list[dict] | None, style: str | None) -> str:
+    """Get one complete English answer from Ollama for an already-retrieved context."""
+    system_prompt = _system_prompt(context, style, decline_off_topic=True)
     messages = [
         {"role": "system", "content": system_prompt},
         *(history or []),
@@ -223,71 +423,60 @@ def call_llm(prompt: str, history: list[dict] | None = None, style: str | None =
     ]
     payload = {"model": MODEL_NAME, "messages": messages, "stream": False}
 
-    try:
+    with metrics.stage("llm"):
         response = requests.post(OLLAMA_API_URL, json=payload, timeout=120)
         response.raise_for_status()
         data = response.json()
-        english_answer = data.get("message", {}).get("content", "No response from model.")
-
-        final_answer, _ = _translate(english_answer, source_lang)
-        return final_answer
-    except Exception as e:
-        print(f"Error calling local Ollama LLM: {e}")
-        return "Sorry, I couldn't process your request."
+    metrics.observe_ollama(data)
+    ratelimit.charge_tokens(data)
+    return data.get("message", {}).get("content", "No response from model.")
+
+def stream_llm_response(
+    prompt: str,
+    history: list[dict] | None = None,
+    style: str | None = None,
+    turn: pipeline.PipelineRun | None = None,
+):
+    """A generator function that streams the response from the LLM with translation.
 
-def stream_llm_response(prompt: str, history: list[dict] | None = None, style: str | None = None):
-    """A generator function that streams the response from the LLM with translation."""
-    english_prompt, source_lang = _translate(prompt, 'en')
+    Pass `turn` when the pre-LLM stages were already started by the caller.
+    """
+    turn = turn or _start_turn(prompt)
+    source_lang = turn.result("detect")
+    english_prompt = turn.result("translate")
 
     # Short-circuit for simple greetings
     if _is_greeting(english_prompt):
+        metrics.FAST_PATH.inc(path="greeting")
         english_answer = "Hello! How can I help you with cybersecurity today?"
-        final_answer, _ = _translate(english_answer, source_lang)
+        final_answer = _translate_text(english_answer, source_lang, "en")
         for word in final_answer.split():
             yield word + " "
         return
 
-    context = retrieve_context(english_prompt)
-    system_prompt = (
-        "You are a professional cybersecurity assistant. "
-        "Write in plain text with minimal Markdown ONLY for code blocks and blockquotes. Do NOT use heading markers (# or ##). Do NOT use asterisks (*) for bold/italics. Keep sentences short and place each sentence on its own line. Leave a blank line between sections.\n\n"
-        "Start with a single TITLE line that states the topic . No markup.\n"
-        "Immediately after the title, write a one- or two-sentence overview WITHOUT any label like 'Summary'. Each sentence on its own line.\n\n"
-        "Then use these sections and styles:\n\n"
-        "Essential Steps\n"
-        "- Hyphen bullets. 3–6 items. One sentence per bullet. Put each bullet on its own line. Do not join bullets on the same line.\n\n"
-        "Advanced Measures\n"
-        "1. Step title on this line.\n\n"
-        "2. Next step title on this line.\n\n"
-        "3. Next step title on this line.\n\n"
-        "Use the exact numbering style with a period (e.g., 1.) and put each numbered item on its own line. Do not join multiple numbers on one line. Add a blank line after each numbered item. Sub-points under a numbered step may use hyphen bullets.\n\n"
-        "```bash\n<commands or code here>\n```\n\n"
-        "> Important notes or warnings should be provided as blockquote lines beginning with '>'.\n\n"
-        "References (optional)\n"
-        "- Links or document names.\n\n"
-        f"{_style_instructions(style)}\n"
-        "Always ground answers in the relevant context below when helpful. Prefer concrete actions over theory."
-        f"\n\n--- Relevant Context ---\n{context}"
-    )
-    messages = [
-        {"role": "system", "content": system_prompt},
-        *(history or []),
-        {"role": "user", "content": english_prompt}
-    ]
-    payload = {"model": MODEL_NAME, "messages": messages, "stream": True}
-
     try:
-        response = requests.post(OLLAMA_API_URL, json=payload, stream=True)
-        response.raise_for_status()
+        context = turn.result("retrieve")
+        if history:
+            english_chunks = _stream_english(english_prompt, context, history, style)
+        else:
+            cache_key = _answer_cache_key(english_prompt, style, context)
+            cached, _source = _lookup_answer(cache_key)
+            if cached is not None:
+                english_chunks = [cached]
+            else:
+                # Concurrent duplicates subscribe to the same token stream
+                english_chunks = _caching_stream(cache_key, stream_flight.stream(
+                    singleflight.make_key(english_prompt, style),
+                    lambda: _stream_english(english_prompt, context, None, style),
+                ))
 
-        english_answer = ""
-        for chunk in response.iter_lines():
-            if chunk:
-                data = json.loads(chunk)
-                english_answer_chunk = data.get("message", {}).get("content", "")
-                english_answer += english_answer_chunk
+        # English needs no translation, so tokens pass straight through
+        if source_lang == "en":
+            yield from english_chunks
+            return
 
-        final_answer, _ = _translate(english_answer, source_lang)
+        english_answer = "".join(english_chunks)
+        final_answer = _translate_text(english_answer, source_lang, "en")
 
         for word in final_answer.split():
             yield word + " "
@@ -296,6 +485,45 @@ def stream_llm_response(prompt: str, history: list[dict] | None = None, style: s
         print(f"Error during streaming: {e}")
         yield "Sorry, an error occurred during streaming."
 
+def _caching_stream(cache_key: str, chunks):
+    """Pass chunks through and store the full answer once the stream completes."""
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    if parts:
+        shared_cache.answers.set(cache_key, "".join(parts))
+
+def _stream_english(english_prompt: str, context: str, history: list[dict] | None, style: str | None):
+    """Yield English answer chunks as Ollama produces them."""
+    system_prompt = _system_prompt(context, style)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        *(history or []),
+        {"role": "user", "content": english_prompt}
+    ]
+    payload = {"model": MODEL_NAME, "messages": messages, "stream": True}
+
+    started = time.perf_counter()
+    first_token_at = None
+    response = requests.post(OLLAMA_API_URL, json=payload, stream=True)
+    response.raise_for_status()
+
+    for chunk in response.iter_lines():
+        if chunk:
+            data = json.loads(chunk)
+            english_answer_chunk = data.get("message", {}).get("content", "")
+            if english_answer_chunk and first_token_at is None:
+                first_token_at = time.perf_counter()
+                metrics.OLLAMA_TTFT.observe(first_token_at - started)
+                metrics.record_stage("llm_ttft", first_token_at - started)
+            if english_answer_chunk:
+                yield english_answer_chunk
+            if data.get("done"):
+                metrics.observe_ollama(data)
+                ratelimit.charge_tokens(data)
+    metrics.record_stage("llm", time.perf_counter() - started)
+
 
 # --- DOWNLOAD HELPERS ---
 def _create_docx(messages):
@@ -343,44 +571,93 @@ def _create_csv(messages):
     file_stream.seek(0)
     return io.BytesIO(file_stream.read().encode('utf-8'))
 
-def _translate(text: str, dest_lang: str):
-    """Translates text to a destination language and detects the source."""
+def _detect_language(text: str) -> str:
+    """Detect the language of `text`; falls back to English on errors."""
+    key = shared_cache.digest("detect", text)
+    cached = shared_cache.translations.get(key)
+    if cached is not None:
+        return cached
     try:
-        translator = Translator()
-        detected_lang = translator.detect(text).lang
-        if detected_lang == dest_lang:
-            return text, detected_lang
-
-        translated = translator.translate(text, dest=dest_lang)
-        return translated.text, detected_lang
+        with metrics.stage("detect"):
+            lang = Translator().detect(text).lang
+    except Exception as e:
+        print(f"Error during language detection: {e}")
+        return 'en'
+    shared_cache.translations.set(key, lang)
+    return lang
+
+def _translate_text(text: str, dest_lang: str, source_lang: str) -> str:
+    """Translate `text` between known languages; returns it unchanged if they match."""
+    if source_lang == dest_lang:
+        return text
+    key = shared_cache.digest(source_lang, dest_lang, text)
+    cached = shared_cache.translations.get(key)
+    if cached is not None:
+        return cached
+    try:
+        with metrics.stage("translate"):
+            translated = Translator().translate(text, dest=dest_lang, src=source_lang).text
     except Exception as e:
         print(f"Error during translation: {e}")
-        return text, 'en'
+        return text
+    shared_cache.translations.set(key, translated)
+    return translated
+
+def _cached_attachment(digest: str):
+    attachment = attachment_store.get(digest)
+    if attachment is None:
+        return None
+    metrics.CACHE_EVENTS.inc(cache="attachment", result="hit")
+    # Cached before an embedding-model change: re-embed the windows once
+    if attachment.ensure_embeddings(retriever.embed_uncached, retriever.model_id):
+        attachment_store.put(digest, attachment)
+    return attachment
+
+def _attachment_scope(request: Request, user_id, guest: bool, session: dict | None) -> str:
+    """Who an `attachment_id` is issued to and accepted from."""
+    if session is not None:
+        return f"user:{session['sub']}"
+    if not guest and user_id:
+        return f"user:{user_id}"
+    return f"ip:{ratelimit.client_ip(request)}"
+
+def _load_attachment(digest: str, fileobj, filename: str | None):
+    """Scan an upload, or reuse the cached scan of identical content."""
+    attachment = _cached_attachment(digest)
+    if attachment is not None:
+        attachment.filename = filename
+        return attachment
+    metrics.CACHE_EVENTS.inc(cache="attachment", result="miss")
+    attachment = attachments.scan_file(fileobj, filename)
+    attachment.ensure_embeddings(retriever.embed_uncached, retriever.model_id)
+    attachment_store.put(digest, attachment)
+    return attachment
 
 # =========================
 # ROUTES
 # =========================
 
 @app.post("/chat/session")
-def create_chat_session(user_id: str = Form(...), title: str = Form("New Chat"), conn=Depends(get_db_connection)):
+def create_chat_session(
+    user_id: str = Form(...),
+    title: str = Form("New Chat"),
+    conn=Depends(get_db_connection),
+    session=Depends(auth.current_session),
+):
     """Create a new chat session for a user."""
+    auth.check_user(session, user_id)
     with conn.cursor() as cursor:
-        cursor.execute(
-            "INSERT INTO chat_sessions (user_id, title) VALUES (%s, %s) RETURNING id, created_at",
-            (user_id, title or "New Chat"),
-        )
+        schema.execute(cursor, "insert_session", (user_id, title or "New Chat"))
         row = cursor.fetchone()
         conn.commit()
         return {"session_id": row.get("id"), "title": title or "New Chat", "created_at": row.get("created_at")}
 
 @app.get("/chat/sessions/{user_id}")
-def list_chat_sessions(user_id: str, conn=Depends(get_db_connection)):
+def list_chat_sessions(user_id: str, conn=Depends(get_db_connection), session=Depends(auth.current_session)):
     """List chat sessions for a user."""
+    auth.check_user(session, user_id)
     with conn.cursor() as cursor:
-        cursor.execute(
-            "SELECT id as session_id, title, created_at FROM chat_sessions WHERE user_id=%s ORDER BY created_at DESC",
-            (user_id,),
-        )
+        schema.execute(cursor, "list_sessions", (user_id,))
         rows = cursor.fetchall()
         return rows
 
@@ -388,38 +665,39 @@ def list_chat_sessions(user_id: str, conn=Depends(get_db_connection)):
 def list_chat_messages(session_id: int, conn=Depends(get_db_connection)):
     """Return messages for a session in chronological order."""
     with conn.cursor() as cursor:
-        cursor.execute(
-            "SELECT role, content, created_at FROM chat_messages WHERE session_id=%s ORDER BY created_at ASC",
-            (session_id,),
-        )
-        rows = cursor.fetchall()
-        return rows
+        return _session_messages(cursor, session_id)
 @app.post("/auth/google")
 def google_auth(google_token: GoogleToken, conn=Depends(get_db_connection)):
+    """Verify a Google ID token, ensure the user exists, and issue a backend session token.
+
+    Send the returned `session_token` as `Authorization: Bearer <token>` on later calls.
+    """
     try:
-        id_info = id_token.verify_oauth2_token(
-            google_token.token, google_requests.Request(), GOOGLE_CLIENT_ID
-        )
+        id_info = auth.verify_google_token(google_token.token, GOOGLE_CLIENT_ID)
         user_email = id_info.get("email")
         user_name = id_info.get("name")
         if not user_email:
             raise HTTPException(status_code=400, detail="Email not found in Google token.")
 
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT id, name, email FROM next_auth.users WHERE email = %s", (user_email,))
+        with metrics.stage("db"), conn.cursor() as cursor:
+            schema.execute(cursor, "upsert_user", (user_name, user_email))
             user = cursor.fetchone()
-
-            if user:
-                print(f"Existing user logged in: {user_email}")
-            else:
-                print(f"Creating new user: {user_email}")
-                cursor.execute(
-                    "INSERT INTO next_auth.users (name, email) VALUES (%s, %s)",
-                    (user_name, user_email)
-                )
-                conn.commit()
-
-        return {"status": "success", "email": user_email}
+            conn.commit()
+        if user["created"]:
+            print(f"Creating new user: {user_email}")
+        else:
+            print(f"Existing user logged in: {user_email}")
+
+        token, expires_at = auth.issue_session_token(user["id"], user_email)
+        return {
+            "status": "success",
+            "email": user_email,
+            "user_id": str(user["id"]),
+            "session_token": token,
+            "expires_at": expires_at,
+        }
+    except HTTPException:
+        raise
     except ValueError:
         raise HTTPException(status_code=401, detail="Invalid Google token.")
     except Exception as e:
@@ -430,6 +708,11 @@ def google_auth(google_token: GoogleToken, conn=Depends(get_db_connection)):
 async def root():
     return {"message": "FastAPI backend is running"}
 
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus text-format exposition of the in-process metrics."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/chat/session")
 def create_chat_session(user_id: str = Form(...), title: str = Form("New Chatt"), conn=Depends(get_db_connection)):
     with conn.cursor() as cursor:
@@ -454,71 +737,98 @@ def get_chat_messages(session_id: int, conn=Depends(get_db_connection)):
 
 @app.post("/chat/message")
 async def send_chat_message(
+    request: Request,
     prompt: str = Form(...),
     user_id: str = Form(...),
     guest: bool = Form(...),
     session_id: int | None = Form(None),
     file: UploadFile | None = File(None),
     style: str | None = Form(None),
-    conn=Depends(get_db_connection)
+    attachment_id: str | None = Form(None),
+    conn=Depends(get_db_connection),
+    session=Depends(auth.current_session),
 ):
+    """Answer a prompt, optionally about an uploaded file.
+
+    Uploads are cached by content hash; the returned `attachment_id` can be sent
+    instead of the file to ask follow-up questions about it. The id is sealed
+    to the caller (session user, claimed user id, or IP for guests).
+    """
+    if not guest:
+        auth.check_user(session, user_id)
+    ratelimit.bind(await run_in_threadpool(ratelimit.enforce, request, guest, session))
+    attachment = None
+    scope = _attachment_scope(request, user_id, guest, session)
     if file:
         try:
-            raw = await file.read()
-            file_text = raw.decode("utf-8", errors="ignore")
-            prompt += f"\n\n--- Attached file ({file.filename}) ---\n{file_text[:2500]}"
+            with metrics.stage("attachment"):
+                digest = await run_in_threadpool(attachments.hash_upload, file.file)
+                attachment = await run_in_threadpool(_load_attachment, digest, file.file, file.filename)
+                attachment_id = auth.seal(scope, digest)
+        except attachments.AttachmentTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
+            attachment_id = None
             print("Error reading uploaded file:", e)
-
-    answer = call_llm(prompt, style=style)
+    elif attachment_id:
+        # Only ids issued to this caller open anything; others look exactly like expired ones
+        digest = auth.unseal(scope, attachment_id)
+        attachment = await run_in_threadpool(_cached_attachment, digest) if digest else None
+        if attachment is None:
+            raise HTTPException(status_code=404, detail="Attachment not found or expired; please upload it again.")
+
+    if attachment is not None:
+        with metrics.stage("attachment_select"):
+            excerpt = await run_in_threadpool(attachment.select_excerpts, prompt, retriever.query_vectors)
+        prompt += f"\n\n--- Attached file ({attachment.filename or 'earlier upload'}) ---\n{excerpt}"
+
+    # Run off the event loop so concurrent requests (and coalescing) actually overlap
+    answer = await run_in_threadpool(call_llm, prompt, style=style)
     if guest:
-        return {"session_id": None, "response": answer}
+        return {"session_id": None, "response": answer, "attachment_id": attachment_id}
 
-    with conn.cursor() as cursor:
+    with metrics.stage("db"), conn.cursor() as cursor:
         if not session_id:
             title = (prompt[:30] + "...") if len(prompt) > 30 else prompt
             if not title.strip():
-                title = file.filename[:30] + "..." if file else "New chat"
-            cursor.execute("INSERT INTO chat_sessions (user_id, title) VALUES (%s, %s) RETURNING id", (user_id, title))
+                title = attachment.filename[:30] + "..." if attachment and attachment.filename else "New chat"
+            schema.execute(cursor, "insert_session", (user_id, title))
             session_id = cursor.fetchone()["id"]
         else:
-            cursor.execute("SELECT id FROM chat_sessions WHERE id=%s", (session_id,))
+            schema.execute(cursor, "session_exists", (session_id,))
             if not cursor.fetchone():
                 raise HTTPException(status_code=404, detail="Session not found")
 
-        cursor.execute("INSERT INTO chat_messages (session_id, role, content) VALUES (%s, %s, %s)", (session_id, "user", prompt))
-        cursor.execute("INSERT INTO chat_messages (session_id, role, content) VALUES (%s, %s, %s)", (session_id, "bot", answer))
+        schema.execute(cursor, "insert_message", (session_id, "user", prompt))
+        schema.execute(cursor, "insert_message", (session_id, "bot", answer))
         conn.commit()
 
-    return {"session_id": session_id, "response": answer}
+    return {"session_id": session_id, "response": answer, "attachment_id": attachment_id}
 
 @app.patch("/chat/session/{session_id}")
 def update_session_title(session_id: int, title: str = Body(...), conn=Depends(get_db_connection)):
     with conn.cursor() as cursor:
-        cursor.execute("UPDATE chat_sessions SET title=%s WHERE id=%s", (title, session_id))
+        schema.execute(cursor, "rename_session", (title, session_id))
         conn.commit()
         return {"session_id": session_id, "title": title}
 
 @app.get("/chat/search")
-def search_user_questions(user_id: str, q: str, limit: int = 20, conn=Depends(get_db_connection)):
+def search_user_questions(
+    user_id: str, q: str, limit: int = 20, conn=Depends(get_db_connection), session=Depends(auth.current_session),
+):
     """Search user-asked messages across all sessions for a user.
     Returns session id, session title, matching content snippet and timestamp.
     """
+    auth.check_user(session, user_id)
     if not user_id or not q:
         raise HTTPException(status_code=400, detail="user_id and q are required")
     like = f"%{q}%"
     with conn.cursor() as cursor:
-        cursor.execute(
-            (
-                "SELECT s.id AS session_id, s.title, m.content, m.created_at "
-                "FROM chat_messages m "
-                "JOIN chat_sessions s ON m.session_id = s.id "
-                "WHERE s.user_id=%s AND m.role='user' AND m.content ILIKE %s "
-                "ORDER BY m.created_at DESC LIMIT %s"
-            ),
-            (user_id, like, limit),
-        )
+        schema.execute(cursor, "search_questions", (user_id, like, limit))
         rows = cursor.fetchall()
+        if len(rows) < limit:
+            # Archived months are older than anything live, so they simply follow
+            rows = list(rows) + retention.search_archived(cursor, user_id, q, limit - len(rows))
         return [
             {
                 "session_id": r["session_id"],
@@ -534,22 +844,62 @@ def delete_chat_session(session_id: int, conn=Depends(get_db_connection)):
     """Delete a chat session and its messages."""
     try:
         with conn.cursor() as cursor:
-            # Delete dependent messages first to satisfy FK constraints
-            cursor.execute("DELETE FROM chat_messages WHERE session_id=%s", (session_id,))
-            cursor.execute("DELETE FROM chat_sessions WHERE id=%s", (session_id,))
+            # Messages go with it via ON DELETE CASCADE (schema migration 3)
+            schema.execute(cursor, "delete_session", (session_id,))
             conn.commit()
         return {"success": True}
     except Exception as e:
         print("Error deleting chat session:", e)
         raise HTTPException(status_code=500, detail="Failed to delete session")
 
+def _init_stream_session(user_id: str, session_id: int | None, prompt: str) -> int:
+    """Ensure a session exists and persist the user message. Returns the session id."""
+    conn = db_pool.getconn()
+    try:
+        with metrics.stage("db"), conn.cursor() as cursor:
+            if not session_id:
+                title = (prompt[:30] + "...") if len(prompt) > 30 else prompt
+                if not title.strip():
+                    title = "New chat"
+                schema.execute(cursor, "insert_session", (user_id, title))
+                session_id = cursor.fetchone()["id"]
+
+            # Persist the user message immediately
+            schema.execute(cursor, "insert_message", (session_id, "user", prompt))
+            conn.commit()
+        return session_id
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db_pool.putconn(conn)
+
+def _sse_response(buffer, after_seq: int = 0, session_id=None):
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Stream-Id": buffer.stream_id}
+    if session_id is not None:
+        headers["X-Session-Id"] = str(session_id)
+    return StreamingResponse(buffer.subscribe(after_seq), media_type="text/event-stream", headers=headers)
+
 @app.post("/chat/stream")
-async def stream_chat_message(request: Request):
-    """Stream assistant response, while persisting user/bot messages for signed-in users.
+async def stream_chat_message(request: Request, session=Depends(auth.current_session)):
+    """Stream assistant response as Server-Sent Events, persisting user/bot messages for signed-in users.
 
     Request JSON body supports: { prompt: str, user_id?: str, guest?: bool, session_id?: int }
     If guest is false and session_id is omitted, a new session is created and returned via header X-Session-Id.
+    Each event id is `<stream id>:<seq>`; re-sending the request with a `Last-Event-ID` header
+    (or GET /chat/stream/{stream_id}) resumes the same generation instead of starting a new one.
+    A `Last-Event-ID` whose stream is gone is a 404, never a second generation (which would
+    also store the user message again). Buffers live in the worker that started the stream,
+    so with several workers resuming needs sticky routing (e.g. by client IP).
     """
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        stream_id, last_seq = sse.parse_event_id(last_event_id)
+        buffer = stream_registry.get(stream_id)
+        if buffer is None:
+            raise HTTPException(status_code=404, detail="Stream not found or expired")
+        return _sse_response(buffer, last_seq)
+
     body = await request.json()
     prompt = body.get("prompt")
     user_id = body.get("user_id")
@@ -559,76 +909,57 @@ async def stream_chat_message(request: Request):
 
     if not prompt:
         raise HTTPException(status_code=400, detail="Prompt is required")
+    if not guest:
+        auth.check_user(session, user_id)
+    ratelimit.bind(await run_in_threadpool(ratelimit.enforce, request, guest, session))
+
+    # For signed-in users, session setup runs alongside detection/translation/retrieval
+    extra_stages = None
+    if not guest:
+        extra_stages = {"db_setup": lambda: _init_stream_session(user_id, session_id, prompt)}
+    turn = _start_turn(prompt, extra_stages)
 
-    # For signed-in users, ensure a session exists and persist the user message first
     header_session_id = None
-    conn = None
-    try:
-        if not guest:
-            conn = db_pool.getconn()
-            with conn.cursor() as cursor:
-                if not session_id:
-                    title = (prompt[:30] + "...") if len(prompt) > 30 else prompt
-                    if not title.strip():
-                        title = "New chat"
-                    cursor.execute(
-                        "INSERT INTO chat_sessions (user_id, title) VALUES (%s, %s) RETURNING id",
-                        (user_id, title),
-                    )
-                    session_id = cursor.fetchone()["id"]
-                header_session_id = session_id
-
-                # Persist the user message immediately
-                cursor.execute(
-                    "INSERT INTO chat_messages (session_id, role, content) VALUES (%s, %s, %s)",
-                    (session_id, "user", prompt),
-                )
-                conn.commit()
-    except Exception as e:
-        # If persistence setup failed for signed-in user, abort early
-        if conn:
-            db_pool.putconn(conn)
-        raise HTTPException(status_code=500, detail=f"Failed to init chat session: {e}")
+    if not guest:
+        try:
+            header_session_id = await asyncio.wrap_future(turn.futures["db_setup"])
+        except Exception as e:
+            # If persistence setup failed for signed-in user, abort early
+            raise HTTPException(status_code=500, detail=f"Failed to init chat session: {e}")
 
-    # Wrap the LLM stream to both yield tokens and accumulate full answer
-    def wrapper_gen():
-        full_answer = ""
+    def persist_answer(full_answer: str):
+        """Runs when generation ends, even if the client has disconnected."""
+        if header_session_id is None:
+            return {}
+        conn = db_pool.getconn()
         try:
-            for chunk in stream_llm_response(prompt, style=style):
-                full_answer += chunk
-                yield chunk
+            with metrics.stage("db"), conn.cursor() as cursor:
+                schema.execute(cursor, "insert_message", (header_session_id, "bot", full_answer))
+                conn.commit()
+        except Exception as e:
+            # Log and ignore persistence failure after streaming
+            print("Error saving streamed assistant message:", e)
         finally:
-            # On stream completion, persist the assistant message for signed-in users
-            if not guest and header_session_id is not None:
-                try:
-                    with (conn or db_pool.getconn()) as conn_ctx:
-                        with conn_ctx.cursor() as cursor:
-                            cursor.execute(
-                                "INSERT INTO chat_messages (session_id, role, content) VALUES (%s, %s, %s)",
-                                (header_session_id, "bot", full_answer),
-                            )
-                            conn_ctx.commit()
-                except Exception as e:
-                    # Log and ignore persistence failure after streaming
-                    print("Error saving streamed assistant message:", e)
-                finally:
-                    if conn:
-                        db_pool.putconn(conn)
-
-    response = StreamingResponse(wrapper_gen(), media_type="text/event-stream")
-    if header_session_id is not None:
-        response.headers["X-Session-Id"] = str(header_session_id)
-    return response
+            db_pool.putconn(conn)
+        return {"session_id": header_session_id}
+
+    buffer = stream_registry.start(stream_llm_response(prompt, style=style, turn=turn), on_complete=persist_answer)
+    return _sse_response(buffer, 0, header_session_id)
+
+@app.get("/chat/stream/{stream_id}")
+def resume_chat_stream(stream_id: str, request: Request):
+    """Reconnect to a live or recently finished stream (EventSource sends Last-Event-ID itself)."""
+    buffer = stream_registry.get(stream_id)
+    if buffer is None:
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    requested_id, last_seq = sse.parse_event_id(request.headers.get("last-event-id"))
+    return _sse_response(buffer, last_seq if requested_id == stream_id else 0)
 
 @app.get("/chat/download/{session_id}")
 def download_chat_session(session_id: int, format: str, conn=Depends(get_db_connection)):
     messages = []
     with conn.cursor() as cursor:
-        cursor.execute(
-            "SELECT role, content FROM chat_messages WHERE session_id=%s ORDER BY created_at ASC",
-            (session_id,)
-        )
-        messages = cursor.fetchall()
+        messages = _session_messages(cursor, session_id)
 
     if not messages:
         raise HTTPException(status_code=404, detail="Session not found or has no messages.")
@@ -653,10 +984,7 @@ def download_chat_session(session_id: int, format: str, conn=Depends(get_db_conn
 
 @app.post("/feedback")
 def submit_feedback(body: FeedbackBody, conn=Depends(get_db_connection)):
-    """Accept simple user feedback and store in the database.
-
-    Creates the `user_feedback` table if it does not exist.
-    """
+    """Accept simple user feedback and store in the database (table created by schema.py)."""
     msg = (body.message or "").strip()
     if not msg:
         raise HTTPException(status_code=400, detail="Feedback message is required")
@@ -671,24 +999,8 @@ def submit_feedback(body: FeedbackBody, conn=Depends(get_db_connection)):
 
     try:
         with conn.cursor() as cursor:
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS user_feedback (
-                    id SERIAL PRIMARY KEY,
-                    user_id TEXT,
-                    rating INT,
-                    category TEXT,
-                    message TEXT NOT NULL,
-                    contact_email TEXT,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                )
-                """
-            )
-            cursor.execute(
-                (
-                    "INSERT INTO user_feedback (user_id, rating, category, message, contact_email)\n"
-                    "VALUES (%s, %s, %s, %s, %s) RETURNING id, created_at"
-                ),
+            schema.execute(
+                cursor, "insert_feedback",
                 (body.user_id, rating, (body.category or None), msg, (body.contact_email or None)),
             )
             row = cursor.fetchone()
@@ -0,0 +1,244 @@
+"""In-process metrics for the chat backend.
+
+Counters, gauges and histograms rendered in the Prometheus text format on
+`/metrics`, plus a per-request stage trace that the optional `X-Trace`
+request header turns into a `Server-Timing` response header.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds. Wide enough to cover a cache hit and a slow CPU generation.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(n, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for n, v in pairs
+    )
+    return "{" + body + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._callback = None
+
+    def set(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, fn):
+        """Sample the gauge lazily at scrape time. `fn` returns {labels-tuple: value}."""
+        self._callback = fn
+
+    def _samples(self):
+        if self._callback is not None:
+            try:
+                items = list(self._callback().items())
+            except Exception as e:
+                print(f"[metrics] gauge {self.name} callback failed: {e}")
+                items = []
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = [(k, list(s[0]), s[1], s[2]) for k, s in self._series.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = ("le", _format_value(float(bound)))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "securum_http_request_seconds", "HTTP request latency until response headers.", ("route", "method", "status"),
+))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "securum_stage_seconds", "Latency of individual hot-path stages.", ("stage",),
+))
+CACHE_EVENTS = REGISTRY.register(Counter(
+    "securum_cache_events_total", "Cache lookups by cache and result (hit/miss).", ("cache", "result"),
+))
+FAST_PATH = REGISTRY.register(Counter(
+    "securum_fast_path_total", "Requests answered without calling the LLM, by reason.", ("path",),
+))
+DB_POOL = REGISTRY.register(Gauge(
+    "securum_db_pool_connections", "Database pool connections by state.", ("state",),
+))
+OLLAMA_TOKENS = REGISTRY.register(Counter(
+    "securum_ollama_tokens_total", "Tokens processed by Ollama (prompt = prompt_eval_count, eval = eval_count).", ("kind",),
+))
+OLLAMA_TTFT = REGISTRY.register(Histogram(
+    "securum_ollama_ttft_seconds", "Time from request to first streamed token from Ollama.",
+))
+OLLAMA_TOKENS_PER_SECOND = REGISTRY.register(Histogram(
+    "securum_ollama_tokens_per_second", "Ollama generation speed (eval_count / eval_duration).", ("kind",),
+    buckets=RATE_BUCKETS,
+))
+
+
+# =========================
+# PER-REQUEST STAGE TRACE
+# =========================
+_trace = contextvars.ContextVar("securum_trace", default=None)
+
+
+def start_trace() -> list:
+    """Begin collecting stage timings for the current request context."""
+    trace = []
+    _trace.set(trace)
+    return trace
+
+
+def record_stage(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as a named stage: feeds the histogram and the request trace."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def format_server_timing(trace) -> str:
+    """Render a trace as a Server-Timing header value (durations in ms)."""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in trace)
+
+
+def observe_ollama(data: dict):
+    """Record the eval statistics Ollama attaches to its final response chunk."""
+    if not data:
+        return
+    for kind, count_key, duration_key in (
+        ("prompt", "prompt_eval_count", "prompt_eval_duration"),
+        ("eval", "eval_count", "eval_duration"),
+    ):
+        count = data.get(count_key) or 0
+        duration_ns = data.get(duration_key) or 0
+        if count:
+            OLLAMA_TOKENS.inc(count, kind=kind)
+        if count and duration_ns:
+            OLLAMA_TOKENS_PER_SECOND.observe(count / (duration_ns / 1e9), kind=kind)
+    if data.get("total_duration"):
+        record_stage("ollama_total", data["total_duration"] / 1e9)
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,90 @@
+"""Explicit stage graph for the work that happens before the LLM sees a prompt.
+
+Stages declare their dependencies and run on a shared thread pool as soon
+as those are satisfied, so independent work (language detection,
+speculative retrieval on the raw prompt, DB session setup) overlaps instead
+of running back to back. No thread ever blocks waiting on a dependency:
+a stage is only submitted once all of its inputs have completed.
+"""
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import metrics
+
+PRE_LLM_WORKERS = int(os.getenv("PRE_LLM_WORKERS", "16"))
+
+executor = ThreadPoolExecutor(max_workers=PRE_LLM_WORKERS, thread_name_prefix="pre-llm")
+
+
+class PipelineRun:
+    """Futures for every stage of one graph execution."""
+
+    def __init__(self, futures: dict):
+        self.futures = futures
+
+    def result(self, name: str, timeout: float | None = None):
+        return self.futures[name].result(timeout)
+
+
+class StageGraph:
+    def __init__(self):
+        self._stages = {}
+
+    def add(self, name: str, fn, deps=()):
+        """Register `fn`, called with each dependency's result as a keyword argument."""
+        missing = [d for d in deps if d not in self._stages]
+        if missing:
+            raise ValueError(f"Stage {name!r} depends on unknown stage(s): {', '.join(missing)}")
+        self._stages[name] = (fn, tuple(deps))
+        return self
+
+    def describe(self) -> dict:
+        return {name: list(deps) for name, (_, deps) in self._stages.items()}
+
+    def run(self, pool: ThreadPoolExecutor | None = None) -> PipelineRun:
+        pool = pool or executor
+        futures = {name: Future() for name in self._stages}
+        waiting = {name: set(deps) for name, (_, deps) in self._stages.items()}
+        lock = threading.Lock()
+        # The caller's context (request trace, rate-limit caller), captured once: stages
+        # with dependencies are launched from done-callbacks on pool threads, whose own
+        # context knows nothing about the request
+        context = contextvars.copy_context()
+
+        def timed(name, fn, kwargs):
+            with metrics.stage(f"pipeline_{name}"):
+                return fn(**kwargs)
+
+        def launch(name):
+            fn, deps = self._stages[name]
+
+            def task():
+                future = futures[name]
+                try:
+                    kwargs = {dep: futures[dep].result() for dep in deps}
+                    # A Context can't be entered twice at once: each stage gets its own copy
+                    value = context.copy().run(timed, name, fn, kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(value)
+
+            pool.submit(task)
+
+        def on_done(name, dep):
+            with lock:
+                pending = waiting[name]
+                pending.discard(dep)
+                ready = not pending
+            if ready:
+                launch(name)
+
+        for name, (_, deps) in self._stages.items():
+            if not deps:
+                launch(name)
+                continue
+            for dep in deps:
+                futures[dep].add_done_callback(lambda _f, name=name, dep=dep: on_done(name, dep))
+        return PipelineRun(futures)
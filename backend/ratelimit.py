@@ -0,0 +1,137 @@
+"""Request rate limits and daily LLM-token quotas for the chat endpoints.
+
+Each caller gets a token bucket: callers with a session token by its user
+id, everyone else by client IP, with separate, tighter settings for guests. Every generated answer is charged to the
+caller's daily quota by Ollama's `eval_count`; once it is used up, further
+chat requests are refused until UTC midnight. Answers served from a cache
+or shared with a concurrent duplicate cost nothing.
+
+State lives in the shared store (shared_cache.py), so limits hold across
+workers; the update is atomic. If the store is unavailable, requests are
+let through rather than failed.
+
+Refusals are 429s with Retry-After; every limited response carries
+X-RateLimit-Limit/-Remaining/-Reset and X-Quota-Limit/-Remaining.
+"""
+import contextvars
+import math
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException, Request
+
+import metrics
+import shared_cache
+
+ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1").strip().lower() not in {"0", "false", "no", "off"}
+TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "").strip().lower() in {"1", "true", "yes", "on"}
+# (requests per minute, burst, LLM tokens per day)
+LIMITS = {
+    "user": (
+        float(os.getenv("RATE_LIMIT_USER_PER_MINUTE", "20")),
+        int(os.getenv("RATE_LIMIT_USER_BURST", "10")),
+        int(os.getenv("QUOTA_USER_TOKENS_PER_DAY", "200000")),
+    ),
+    "guest": (
+        float(os.getenv("RATE_LIMIT_GUEST_PER_MINUTE", "6")),
+        int(os.getenv("RATE_LIMIT_GUEST_BURST", "3")),
+        int(os.getenv("QUOTA_GUEST_TOKENS_PER_DAY", "20000")),
+    ),
+}
+
+RATE_LIMITED = metrics.REGISTRY.register(metrics.Counter(
+    "securum_rate_limited_total", "Chat requests refused by rate limits and quotas.", ("tier", "reason"),
+))
+
+buckets = shared_cache.Namespace("ratelimit", 3600, track=False)
+quotas = shared_cache.Namespace("quota", 2 * 86400, track=False)
+_caller = contextvars.ContextVar("ratelimit_caller", default=None)
+
+
+def client_ip(request: Request) -> str:
+    if TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for", "")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def identify(request: Request, guest: bool, session: dict | None) -> tuple[str, str]:
+    """Returns (tier, caller key).
+
+    Only a session token proves who the caller is; the `user_id` field is the
+    client's say-so, so without a token the caller is keyed on its IP (one
+    bucket and quota per address, however many user ids it claims).
+    """
+    if session is not None:
+        return "user", f"user:{session['sub']}"
+    return ("guest" if guest else "user"), f"ip:{client_ip(request)}"
+
+
+def _take(state: dict | None, now: float, per_second: float, burst: int) -> dict:
+    tokens = burst if state is None else min(burst, state["tokens"] + (now - state["ts"]) * per_second)
+    allowed = tokens >= 1
+    return {"tokens": tokens - 1 if allowed else tokens, "ts": now, "allowed": allowed}
+
+
+def _quota_key(caller: str, now: datetime) -> str:
+    return f"{caller}:{now:%Y-%m-%d}"
+
+
+def enforce(request: Request, guest: bool = False, session: dict | None = None):
+    """Charge one request to the caller's bucket; raise 429 when over the rate or the daily quota.
+
+    Does blocking store I/O, so async routes run it in the threadpool. Returns
+    the caller key for `bind` (None when limiting is off).
+    """
+    if not ENABLED:
+        return None
+    tier, caller = identify(request, guest, session)
+    per_minute, burst, daily_tokens = LIMITS[tier]
+    per_second = per_minute / 60
+    now = datetime.now(timezone.utc)
+    headers = {}
+
+    used = (quotas.get(_quota_key(caller, now)) or {}).get("used", 0)
+    headers["X-Quota-Limit"] = str(daily_tokens)
+    headers["X-Quota-Remaining"] = str(max(0, daily_tokens - used))
+    if used >= daily_tokens:
+        midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        headers["Retry-After"] = str(math.ceil((midnight - now).total_seconds()))
+        RATE_LIMITED.inc(tier=tier, reason="quota")
+        raise HTTPException(status_code=429, detail="Daily usage limit reached. Please try again tomorrow.", headers=headers)
+
+    state = buckets.update(caller, lambda s: _take(s, time.time(), per_second, burst))
+    if state is not None:
+        headers["X-RateLimit-Limit"] = str(burst)
+        headers["X-RateLimit-Remaining"] = str(int(state["tokens"]))
+        headers["X-RateLimit-Reset"] = str(math.ceil((burst - state["tokens"]) / per_second))
+        if not state["allowed"]:
+            headers["Retry-After"] = str(math.ceil((1 - state["tokens"]) / per_second))
+            RATE_LIMITED.inc(tier=tier, reason="rate")
+            raise HTTPException(status_code=429, detail="Too many requests. Please slow down.", headers=headers)
+
+    request.state.rate_limit_headers = headers
+    return caller
+
+
+def bind(caller: str | None):
+    """Bill answers generated in the current context to `caller` (see `charge_tokens`).
+
+    Called from the route itself: a contextvar set inside the threadpool
+    would not be seen by the generation it starts.
+    """
+    _caller.set(caller)
+
+
+def charge_tokens(data: dict):
+    """Bill Ollama's `eval_count` from a final response chunk to the caller bound by `bind`."""
+    caller = _caller.get()
+    count = (data or {}).get("eval_count") or 0
+    if caller is None or not count:
+        return
+    quotas.update(
+        _quota_key(caller, datetime.now(timezone.utc)),
+        lambda q: {"used": (q or {}).get("used", 0) + count},
+    )
@@ -1,9 +1,39 @@
+import argparse
+
 import chromadb
 
-# Connect to ChromaDB
-client = chromadb.PersistentClient(path="chroma_db")
+import vector_store
 
-# Delete the collection completely
-client.delete_collection(name="cybersecurity")
+parser = argparse.ArgumentParser(description="Manage versions of the knowledge-base collection.")
+group = parser.add_mutually_exclusive_group()
+group.add_argument("--rollback", action="store_true", help="point the alias back at the previous version")
+group.add_argument("--gc", action="store_true", help="delete versions beyond --keep previous ones")
+group.add_argument("--drop-all", action="store_true", help="delete every version, the alias and the legacy collection")
+parser.add_argument("--keep", type=int, default=vector_store.KEEP_VERSIONS)
+args = parser.parse_args()
+
+# Connect to ChromaDB
+client = chromadb.PersistentClient(path=vector_store.CHROMA_PATH)
+alias = vector_store.ALIAS
 
-print("✅ Collection 'cybersecurity' deleted. You can now ingest new data.")
+if args.rollback:
+    target = vector_store.rollback(alias)
+    print(f"✅ Alias '{alias}' now points at {target}. Running workers switch within seconds.")
+elif args.gc:
+    deleted = vector_store.gc(client, alias, keep=args.keep)
+    print("🧹 Removed:", ", ".join(deleted) if deleted else "nothing")
+elif args.drop_all:
+    for _, name in vector_store.list_versions(client, alias):
+        client.delete_collection(name)
+    try:
+        client.delete_collection(name=alias)
+    except Exception:
+        pass
+    vector_store.remove_alias(alias)
+    print(f"✅ Collection '{alias}' and all its versions deleted. You can now ingest new data.")
+else:
+    active = vector_store.active_name(alias)
+    for _, name in vector_store.list_versions(client, alias):
+        print(("* " if name == active else "  ") + name)
+    if active == alias:
+        print(f"* {alias} (legacy, unversioned)")
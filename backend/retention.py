@@ -0,0 +1,275 @@
+"""Archive cold chat_messages partitions to disk and drop them.
+
+    python retention.py                 # archive months older than CHAT_RETENTION_MONTHS
+    python retention.py --keep-months 6 --dry-run
+    python retention.py --convert       # once: partition a pre-existing chat_messages
+
+Run it daily (cron/systemd timer); it also creates upcoming monthly
+partitions and moves rows that landed in the default partition into their
+month's, so they are archived like any other. Each cold partition becomes `<CHAT_ARCHIVE_DIR>/<partition>.csv.gz`,
+written as one gzip member per session so a single session can be read back
+with one seek. `archived_sessions` records where each session's member
+lives; main.py merges those rows back in when a session is opened,
+downloaded or searched, so archiving is invisible to users. The whole file
+is still ordinary gzip'd CSV (`zcat` works), columns:
+id, session_id, role, content, created_at (ISO 8601).
+
+The partition is only detached and dropped after its archive has been
+fsynced and the row counts match, in the same transaction that records the
+index, so a crash at any point leaves either the live partition or a
+complete archive. Deleting a session removes its index rows (FK cascade);
+the bytes stay in the archive file until it is deleted. Search reads at
+most CHAT_ARCHIVE_SEARCH_SEGMENTS sessions' members, newest months first.
+
+--convert partitions a chat_messages that predates migration 4 (which
+only converts an empty table at startup): it swaps in the partitioned table
+in one short transaction, then copies the old rows over in id order,
+--batch-size rows per transaction, and drops the old table at the end.
+Rows not yet copied are missing from the app, so run it in a maintenance
+window; an interrupted run resumes where it stopped.
+"""
+import argparse
+import csv
+import gzip
+import io
+import itertools
+import os
+from datetime import datetime, timezone
+
+import psycopg2
+from dotenv import load_dotenv
+
+# Before the local imports, which read their settings at import time (as in main.py)
+load_dotenv()
+
+import schema
+
+RETENTION_MONTHS = int(os.getenv("CHAT_RETENTION_MONTHS", "12"))
+ARCHIVE_DIR = os.getenv("CHAT_ARCHIVE_DIR", "chat_archive")
+ARCHIVE_COLUMNS = ("id", "session_id", "role", "content", "created_at")
+SEARCH_SEGMENTS = int(os.getenv("CHAT_ARCHIVE_SEARCH_SEGMENTS", "200"))
+CONVERT_BATCH_ROWS = int(os.getenv("CHAT_CONVERT_BATCH_ROWS", "10000"))
+
+_archive_table = False
+
+
+def convert_to_partitions(conn, batch_size: int = CONVERT_BATCH_ROWS) -> int:
+    """Partition a populated legacy chat_messages, copying rows in batches. Returns rows copied."""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(schema.PARTITION_SWAP)
+        conn.commit()
+        if schema.relation_kind(conn, "chat_messages_legacy") is None:
+            conn.commit()
+            return 0
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COALESCE(max(id), 0) FROM chat_messages_legacy")
+            last = cursor.fetchone()[0]
+            # New messages draw ids above the legacy ones, so this is where a previous run stopped
+            cursor.execute("SELECT COALESCE(max(id), 0) FROM chat_messages WHERE id <= %s", (last,))
+            position = cursor.fetchone()[0]
+        conn.commit()
+        copied = 0
+        while position < last:
+            upper = min(position + batch_size, last)
+            with conn.cursor() as cursor:
+                # Orphans (possible only under a legacy NOT VALID FK) belong to no session and are not carried over
+                cursor.execute(
+                    "INSERT INTO chat_messages (id, session_id, role, content, created_at) "
+                    "SELECT l.id, l.session_id, l.role, l.content, COALESCE(l.created_at, NOW()) "
+                    "FROM chat_messages_legacy l "
+                    "WHERE l.id > %s AND l.id <= %s "
+                    "AND EXISTS (SELECT 1 FROM chat_sessions s WHERE s.id = l.session_id)",
+                    (position, upper),
+                )
+                copied += cursor.rowcount
+            conn.commit()
+            position = upper
+            print(f"Copied messages up to id {position} of {last}")
+        with conn.cursor() as cursor:
+            cursor.execute("DROP TABLE chat_messages_legacy")
+        conn.commit()
+        return copied
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def cold_partitions(conn, keep_months: int = RETENTION_MONTHS, today=None) -> list[str]:
+    """Partitions whose whole month is older than the `keep_months` most recent ones."""
+    cutoff = schema.add_months(schema.month_start(today or datetime.now(timezone.utc)), -keep_months)
+    cold = []
+    for name in schema.list_partitions(conn):
+        month = schema.partition_month(name)
+        if month is not None and month < cutoff:
+            cold.append(name)
+    return cold
+
+
+def _write_archive(cursor, path: str) -> tuple[list[tuple], int]:
+    """Stream rows (ordered by session) into gzip members. Returns the index entries and row count."""
+    index, total, offset = [], 0, 0
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        for session_id, rows in itertools.groupby(cursor, key=lambda r: r[1]):
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            count = 0
+            for row in rows:
+                writer.writerow([row[0], row[1], row[2], row[3], row[4].isoformat()])
+                count += 1
+            member = gzip.compress(buf.getvalue().encode("utf-8"), compresslevel=6)
+            f.write(member)
+            index.append((session_id, offset, len(member), count))
+            offset += len(member)
+            total += count
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return index, total
+
+
+def archive_partition(conn, name: str, archive_dir: str = ARCHIVE_DIR) -> int:
+    """Archive one partition, record its sessions, then detach and drop it. Returns rows archived."""
+    os.makedirs(archive_dir, exist_ok=True)
+    filename = f"{name}.csv.gz"
+    try:
+        with conn.cursor() as cursor:
+            # Block late writers so the archive and the partition can't diverge
+            cursor.execute(f'LOCK TABLE "{name}" IN SHARE MODE')
+            cursor.execute(f'SELECT count(*) FROM "{name}"')
+            expected = cursor.fetchone()[0]
+        with conn.cursor(name=f"archive_{name}") as rows:
+            rows.itersize = 5000
+            rows.execute(
+                f'SELECT {", ".join(ARCHIVE_COLUMNS)} FROM "{name}" ORDER BY session_id, created_at, id'
+            )
+            index, total = _write_archive(rows, os.path.join(archive_dir, filename))
+        if total != expected:
+            raise RuntimeError(f"{name}: archived {total} rows, expected {expected}")
+        with conn.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO archived_sessions "
+                "(session_id, partition, archive_file, byte_offset, byte_length, message_count) "
+                "VALUES (%s, %s, %s, %s, %s, %s) "
+                "ON CONFLICT (session_id, partition) DO UPDATE SET archive_file = EXCLUDED.archive_file, "
+                "byte_offset = EXCLUDED.byte_offset, byte_length = EXCLUDED.byte_length, "
+                "message_count = EXCLUDED.message_count, archived_at = NOW()",
+                [(session_id, name, filename, offset, length, count) for session_id, offset, length, count in index],
+            )
+            cursor.execute(f'ALTER TABLE chat_messages DETACH PARTITION "{name}"')
+            cursor.execute(f'DROP TABLE "{name}"')
+        conn.commit()
+        return total
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _read_member(archive_dir: str, filename: str, offset: int, length: int) -> list[list[str]]:
+    with open(os.path.join(archive_dir, filename), "rb") as f:
+        f.seek(offset)
+        data = gzip.decompress(f.read(length)).decode("utf-8")
+    return list(csv.reader(io.StringIO(data)))
+
+
+def _message(row: list[str]) -> dict:
+    return {"role": row[2], "content": row[3], "created_at": datetime.fromisoformat(row[4])}
+
+
+def archive_available(cursor) -> bool:
+    """Whether archived_sessions exists (it may not if migrations were skipped or failed).
+
+    Checked on every call until it does, then assumed to stay. `cursor` must return dict rows.
+    """
+    global _archive_table
+    if not _archive_table:
+        cursor.execute("SELECT to_regclass('archived_sessions') IS NOT NULL AS present")
+        _archive_table = cursor.fetchone()["present"]
+    return _archive_table
+
+
+def load_archived(cursor, session_id: int, archive_dir: str = ARCHIVE_DIR) -> list[dict]:
+    """Archived messages of one session, oldest first. `cursor` must return dict rows."""
+    if not archive_available(cursor):
+        return []
+    schema.execute(cursor, "archived_segments", (session_id,))
+    messages = []
+    for segment in cursor.fetchall():
+        try:
+            rows = _read_member(archive_dir, segment["archive_file"], segment["byte_offset"], segment["byte_length"])
+        except OSError as e:
+            print(f"Archive {segment['archive_file']} unreadable for session {session_id}: {e}")
+            continue
+        messages.extend(_message(row) for row in rows)
+    return messages
+
+
+def search_archived(cursor, user_id: str, q: str, limit: int, archive_dir: str = ARCHIVE_DIR,
+                    max_segments: int = SEARCH_SEGMENTS) -> list[dict]:
+    """User questions containing `q` in a user's archived sessions, newest first.
+
+    Reads at most `max_segments` members, and stops at the first older month
+    once `limit` hits are in hand: every message in it is older than those.
+    """
+    if not archive_available(cursor):
+        return []
+    needle = q.lower()
+    schema.execute(cursor, "archived_user_segments", (user_id, max_segments))
+    hits = []
+    month = None
+    for segment in cursor.fetchall():
+        if segment["partition"] != month:
+            if len(hits) >= limit:
+                break
+            month = segment["partition"]
+        try:
+            rows = _read_member(archive_dir, segment["archive_file"], segment["byte_offset"], segment["byte_length"])
+        except OSError as e:
+            print(f"Archive {segment['archive_file']} unreadable: {e}")
+            continue
+        for row in rows:
+            if row[2] == "user" and needle in row[3].lower():
+                hits.append({"session_id": segment["session_id"], "title": segment["title"], **_message(row)})
+    hits.sort(key=lambda h: h["created_at"], reverse=True)
+    return hits[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive and drop cold chat_messages partitions.")
+    parser.add_argument("--keep-months", type=int, default=RETENTION_MONTHS, help="recent months kept live")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    parser.add_argument("--dry-run", action="store_true", help="only list what would be archived")
+    parser.add_argument("--convert", action="store_true", help="partition a pre-existing chat_messages, then archive")
+    parser.add_argument("--batch-size", type=int, default=CONVERT_BATCH_ROWS, help="rows per --convert transaction")
+    args = parser.parse_args()
+
+    candidates = schema.database_urls()
+    if not candidates:
+        raise SystemExit("No database URL found. Set PY_DATABASE_URL or DATABASE_URL or DIRECT_URL")
+    conn = psycopg2.connect(schema.sanitize_dsn(candidates[0][1]))
+    try:
+        schema.migrate(conn)
+        if args.convert and args.dry_run:
+            print("Would convert chat_messages to monthly partitions")
+        elif args.convert:
+            print(f"Converted chat_messages: {convert_to_partitions(conn, args.batch_size)} messages copied")
+        if not args.dry_run and schema.relation_kind(conn, "chat_messages") != "p":
+            raise SystemExit("chat_messages is not partitioned yet; run with --convert first")
+        for name in schema.ensure_partitions(conn):
+            print(f"Created partition {name}")
+        cold = cold_partitions(conn, args.keep_months)
+        if not cold:
+            print("Nothing to archive.")
+        for name in cold:
+            if args.dry_run:
+                print(f"Would archive {name}")
+                continue
+            rows = archive_partition(conn, name, args.archive_dir)
+            print(f"Archived {name}: {rows} messages -> {os.path.join(args.archive_dir, name + '.csv.gz')}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
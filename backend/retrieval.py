@@ -0,0 +1,128 @@
+"""Post-retrieval stage: turn raw Chroma hits into a compact prompt context.
+
+1. over-fetch RETRIEVAL_OVERFETCH candidates (done by the caller's query)
+2. drop anything farther than RETRIEVAL_MAX_DISTANCE
+3. merge neighbouring chunks of the same source section, removing their overlap
+4. optionally rerank (RETRIEVAL_RERANK=lexical)
+5. pack passages best-first into RETRIEVAL_TOKEN_BUDGET
+
+The result is empty when nothing is relevant, so the prompt carries no
+context section at all instead of three arbitrary chunks.
+"""
+import math
+import os
+import re
+
+OVERFETCH = int(os.getenv("RETRIEVAL_OVERFETCH", "12"))
+# Chroma's default space is squared L2 over normalized embeddings (0..4).
+MAX_DISTANCE = float(os.getenv("RETRIEVAL_MAX_DISTANCE", "1.3"))
+TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "500"))
+RERANK = os.getenv("RETRIEVAL_RERANK", "").strip().lower()
+CHARS_PER_TOKEN = 4
+# Matches ingest_chroma.chunk_text; used when a chunk's metadata predates the `overlap` field.
+DEFAULT_CHUNK_OVERLAP = 50
+
+_WORD = re.compile(r"[a-z0-9]{3,}")
+
+
+class Passage:
+    __slots__ = ("text", "distance", "source", "first_chunk", "last_chunk", "score")
+
+    def __init__(self, text, distance, source, first_chunk, last_chunk):
+        self.text = text
+        self.distance = distance
+        self.source = source
+        self.first_chunk = first_chunk
+        self.last_chunk = last_chunk
+        self.score = -distance
+
+
+def candidates_from_results(results: dict, max_distance: float = MAX_DISTANCE) -> list[dict]:
+    """Flatten a single-query Chroma result, keeping hits within `max_distance`."""
+    documents = (results.get("documents") or [[]])[0] or []
+    distances = (results.get("distances") or [[]])[0] or [0.0] * len(documents)
+    metadatas = (results.get("metadatas") or [[]])[0] or [{}] * len(documents)
+    candidates = []
+    for text, distance, meta in zip(documents, distances, metadatas):
+        if not text or distance is None or distance > max_distance:
+            continue
+        meta = meta or {}
+        candidates.append({
+            "text": text,
+            "distance": float(distance),
+            "source": meta.get("source", ""),
+            "section": meta.get("section", ""),
+            "chunk": meta.get("chunk"),
+            "overlap": int(meta.get("overlap", DEFAULT_CHUNK_OVERLAP)),
+        })
+    return candidates
+
+
+def merge_adjacent(candidates: list[dict]) -> list[Passage]:
+    """Join consecutive chunks of one source section into a single passage without duplicated overlap."""
+    passages = []
+    indexed = sorted(
+        (c for c in candidates if isinstance(c["chunk"], int)),
+        key=lambda c: (c["source"], c["section"], c["chunk"]),
+    )
+    current = None
+    current_section = None
+    for c in indexed:
+        if (
+            current is not None
+            and c["source"] == current.source
+            and c["section"] == current_section
+            and c["chunk"] == current.last_chunk + 1
+        ):
+            current.text += c["text"][c["overlap"]:]
+            current.last_chunk = c["chunk"]
+            current.distance = min(current.distance, c["distance"])
+            current.score = -current.distance
+            continue
+        current = Passage(c["text"], c["distance"], c["source"], c["chunk"], c["chunk"])
+        current_section = c["section"]
+        passages.append(current)
+    for c in candidates:
+        if not isinstance(c["chunk"], int):
+            passages.append(Passage(c["text"], c["distance"], c["source"], None, None))
+    return passages
+
+
+def lexical_rerank(query: str, passages: list[Passage]) -> list[Passage]:
+    """Blend vector distance with query-term coverage; cheap enough for CPU-only hosts."""
+    terms = set(_WORD.findall(query.lower()))
+    if not terms:
+        return passages
+    for p in passages:
+        words = _WORD.findall(p.text.lower())
+        coverage = len(terms & set(words)) / len(terms)
+        p.score = -p.distance + 0.5 * coverage + 0.05 * math.log1p(len(words)) * coverage
+    return passages
+
+
+RERANKERS = {"lexical": lexical_rerank}
+
+
+def pack(passages: list[Passage], token_budget: int = TOKEN_BUDGET) -> str:
+    """Best-first packing into the budget; the best passage is truncated rather than dropped."""
+    budget = token_budget * CHARS_PER_TOKEN
+    chosen = []
+    for p in sorted(passages, key=lambda p: p.score, reverse=True):
+        text = p.text.strip()
+        if not text:
+            continue
+        if len(text) > budget:
+            if not chosen:
+                chosen.append(text[:budget])
+            continue
+        chosen.append(text)
+        budget -= len(text) + 2
+    return "\n\n".join(chosen)
+
+
+def build_context(query: str, results: dict, reranker: str = RERANK, token_budget: int = TOKEN_BUDGET) -> str:
+    passages = merge_adjacent(candidates_from_results(results))
+    rerank = RERANKERS.get(reranker)
+    if rerank is not None:
+        passages = rerank(query, passages)
+    return pack(passages, token_budget)
@@ -0,0 +1,184 @@
+"""Vector retrieval and embedding as one local sidecar for all uvicorn workers.
+
+    python retrieval_sidecar.py            # serves on RETRIEVAL_SIDECAR_SOCKET
+    RETRIEVAL_SIDECAR_SOCKET=/run/securum/retrieval.sock uvicorn main:app --workers 4
+
+Without the sidecar every worker opens its own Chroma client, embedding
+model and HNSW index. With RETRIEVAL_SIDECAR_SOCKET set, workers skip all
+of that and send queries over a Unix socket to this process, which holds
+the only copy. The sidecar also runs the knowledge-base watcher when
+KB_WATCH is on, so collection swaps and hot reloads happen in one place.
+
+Wire format: 4-byte big-endian length, then a JSON object, in both
+directions. Connections are persistent; each worker thread keeps its own.
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SOCKET_PATH = os.getenv("RETRIEVAL_SIDECAR_SOCKET", "")
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("RETRIEVAL_SIDECAR_TIMEOUT", "30"))
+INCLUDE = ["documents", "metadatas", "distances"]
+_HEADER = struct.Struct(">I")
+
+
+def _send(sock, message: dict):
+    data = json.dumps(message, default=lambda o: o.tolist()).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("Retrieval sidecar connection closed")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def _recv(sock) -> dict:
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return json.loads(_recv_exact(sock, size))
+
+
+class LocalRetriever:
+    """In-process retrieval; what the sidecar serves and what workers use without one."""
+
+    def __init__(self, collection_handle, embedder):
+        self.collection_handle = collection_handle
+        self.embedder = embedder
+        self.model_id = embedder.model_id
+
+    def query(self, text: str, n_results: int) -> dict:
+        return self.collection_handle.get().query(
+            query_embeddings=[self.embedder.query_vector(text)], n_results=n_results, include=INCLUDE,
+        )
+
+    def embed_uncached(self, texts: list[str]):
+        return self.embedder.embed_uncached(texts)
+
+    def query_vectors(self, texts: list[str]):
+        return self.embedder.query_vectors(texts)
+
+
+class RetrievalClient:
+    """Same surface as LocalRetriever, answered by the sidecar."""
+
+    def __init__(self, path: str = SOCKET_PATH):
+        self.path = path
+        self._local = threading.local()
+        self.model_id = self._call("model_id")
+
+    def _socket(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(CONNECT_TIMEOUT_SECONDS)
+            sock.connect(self.path)
+            self._local.sock = sock
+        return sock
+
+    def _call(self, op: str, **args):
+        for attempt in (1, 2):
+            try:
+                sock = self._socket()
+                _send(sock, {"op": op, **args})
+                reply = _recv(sock)
+                break
+            except (OSError, ConnectionError):
+                # Sidecar restarted: reconnect once
+                sock = getattr(self._local, "sock", None)
+                if sock is not None:
+                    sock.close()
+                self._local.sock = None
+                if attempt == 2:
+                    raise
+        if "error" in reply:
+            raise RuntimeError(f"Retrieval sidecar: {reply['error']}")
+        return reply["result"]
+
+    def query(self, text: str, n_results: int) -> dict:
+        return self._call("query", text=text, n_results=n_results)
+
+    def embed_uncached(self, texts: list[str]):
+        return self._call("embed_uncached", texts=texts)
+
+    def query_vectors(self, texts: list[str]):
+        return self._call("query_vectors", texts=texts)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        retriever = self.server.retriever
+        ops = {
+            "model_id": lambda: retriever.model_id,
+            "query": lambda text, n_results: retriever.query(text, n_results),
+            "embed_uncached": lambda texts: retriever.embed_uncached(texts),
+            "query_vectors": lambda texts: retriever.query_vectors(texts),
+        }
+        while True:
+            try:
+                message = _recv(self.request)
+            except (OSError, ConnectionError):
+                return
+            op = ops.get(message.pop("op", None))
+            try:
+                if op is None:
+                    raise ValueError("unknown op")
+                reply = {"result": op(**message)}
+            except Exception as e:
+                reply = {"error": str(e)}
+            try:
+                _send(self.request, reply)
+            except OSError:
+                return
+
+
+class SidecarServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, retriever: LocalRetriever):
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o660)
+        self.retriever = retriever
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve vector retrieval and embeddings over a Unix socket.")
+    parser.add_argument("--socket", default=SOCKET_PATH or "/tmp/securum-retrieval.sock")
+    args = parser.parse_args()
+
+    import chromadb
+
+    import embeddings
+    import kb_watcher
+    import shared_cache
+    import vector_store
+
+    embedder = embeddings.get_service()
+    handle = vector_store.CollectionHandle(chromadb.PersistentClient(path=vector_store.CHROMA_PATH), embedder)
+    if kb_watcher.WATCH_ENABLED:
+        kb_watcher.on_reload(lambda _source: shared_cache.answers.clear())
+        kb_watcher.start(handle)
+    server = SidecarServer(args.socket, LocalRetriever(handle, embedder))
+    print(f"[sidecar] Serving {handle.name} with {embedder.model_id} on {args.socket}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+"""Schema ownership for the chat tables: startup migrations and prepared statements.
+
+`migrate(conn)` applies the numbered MIGRATIONS that are missing from
+`schema_migrations`, under an advisory lock so concurrently starting
+workers don't race. Migrations only ever add: existing tables and data
+(created before the backend owned the schema) are adopted as they are.
+
+Hot queries live in STATEMENTS and run through `execute`, which PREPAREs
+each one once per connection and EXECUTEs it afterwards, so Postgres skips
+parsing and planning on every request. That needs a session-scoped
+connection: behind a transaction pooler (`pgbouncer=true` DSNs) or with
+DB_PREPARED_STATEMENTS=0 the same SQL runs unprepared.
+
+`chat_messages` is range-partitioned by month (`chat_messages_pYYYYMM`, UTC
+bounds) so each month's rows, indexes and vacuum work stay the same size
+however much history accumulates. `ensure_partitions` creates the months
+ahead; a default partition catches anything that arrives before it runs,
+and the next run moves those rows into their month's partition. Old months
+are archived and dropped by retention.py. A chat_messages that already has
+rows is not converted at startup (the copy would lock it for its duration):
+`python retention.py --convert` does that in batches, and until then the
+backend runs on the plain table and says so at startup.
+"""
+import os
+import re
+from datetime import date, datetime, timezone
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import psycopg2.errors
+import psycopg2.extensions
+
+PREPARED_ENABLED = os.getenv("DB_PREPARED_STATEMENTS", "1").strip().lower() not in {"0", "false", "no", "off"}
+PARTITION_MONTHS_AHEAD = int(os.getenv("CHAT_PARTITION_MONTHS_AHEAD", "2"))
+# Arbitrary, stable key for pg_advisory_xact_lock
+MIGRATION_LOCK_KEY = 7_042_001
+
+# Statements (PL/pgSQL, declaring `seq text` and `m date`) that rename a plain
+# chat_messages to chat_messages_legacy and put an empty partitioned table in
+# its place, sharing the id sequence. Migration 4 runs them on an empty table;
+# retention.py --convert on a populated one, then copies the rows in batches.
+_PARTITION_SWAP = """
+            ALTER TABLE chat_messages RENAME TO chat_messages_legacy;
+            ALTER INDEX IF EXISTS chat_messages_session_created_idx RENAME TO chat_messages_legacy_session_created_idx;
+            seq := pg_get_serial_sequence('chat_messages_legacy', 'id');
+            IF seq IS NULL THEN
+                CREATE SEQUENCE IF NOT EXISTS chat_messages_id_seq;
+                seq := 'chat_messages_id_seq';
+                ALTER TABLE chat_messages_legacy ALTER COLUMN id SET DEFAULT nextval('chat_messages_id_seq');
+                PERFORM setval(seq, GREATEST((SELECT max(id) FROM chat_messages_legacy), 1));
+            END IF;
+            EXECUTE format('ALTER SEQUENCE %s AS bigint', seq);
+
+            CREATE TABLE chat_messages (LIKE chat_messages_legacy INCLUDING DEFAULTS)
+                PARTITION BY RANGE (created_at);
+            ALTER TABLE chat_messages ALTER COLUMN id TYPE bigint;
+            ALTER TABLE chat_messages ALTER COLUMN created_at SET NOT NULL;
+            ALTER TABLE chat_messages ALTER COLUMN created_at SET DEFAULT NOW();
+            -- The partition key has to be part of the primary key
+            ALTER TABLE chat_messages ADD PRIMARY KEY (id, created_at);
+            ALTER TABLE chat_messages ADD CONSTRAINT chat_messages_session_id_fkey
+                FOREIGN KEY (session_id) REFERENCES chat_sessions(id) ON DELETE CASCADE;
+            -- Keeps the sequence alive when the legacy table is dropped
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY chat_messages.id', seq);
+
+            m := date_trunc('month', COALESCE(
+                (SELECT min(created_at) FROM chat_messages_legacy), NOW()
+            ) AT TIME ZONE 'UTC')::date;
+            WHILE m <= (date_trunc('month', NOW() AT TIME ZONE 'UTC') + interval '2 months')::date LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF chat_messages FOR VALUES FROM (%L) TO (%L)',
+                    'chat_messages_p' || to_char(m, 'YYYYMM'),
+                    to_char(m, 'YYYY-MM-DD') || ' 00:00:00+00',
+                    to_char(m + interval '1 month', 'YYYY-MM-DD') || ' 00:00:00+00'
+                );
+                m := (m + interval '1 month')::date;
+            END LOOP;
+            CREATE TABLE chat_messages_default PARTITION OF chat_messages DEFAULT;
+            -- Same index as migration 2, now created per partition
+            CREATE INDEX chat_messages_session_created_idx
+                ON chat_messages (session_id, created_at) INCLUDE (role);
+"""
+
+# The swap on its own, for retention.py --convert; a no-op once chat_messages is partitioned
+PARTITION_SWAP = """
+    DO $$
+    DECLARE
+        seq text;
+        m date;
+    BEGIN
+        IF (SELECT relkind FROM pg_class WHERE oid = 'chat_messages'::regclass) = 'p' THEN
+            RETURN;
+        END IF;
+""" + _PARTITION_SWAP + """
+    END $$;
+"""
+
+MIGRATIONS = [
+    (1, "chat and feedback tables", """
+        CREATE TABLE IF NOT EXISTS chat_sessions (
+            id SERIAL PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            title TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id SERIAL PRIMARY KEY,
+            session_id INT NOT NULL REFERENCES chat_sessions(id) ON DELETE CASCADE,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE TABLE IF NOT EXISTS user_feedback (
+            id SERIAL PRIMARY KEY,
+            user_id TEXT,
+            rating INT,
+            category TEXT,
+            message TEXT NOT NULL,
+            contact_email TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """),
+    (2, "hot-path indexes", """
+        -- Session list: index-only scan in display order (titles are short labels)
+        CREATE INDEX IF NOT EXISTS chat_sessions_user_created_idx
+            ON chat_sessions (user_id, created_at DESC) INCLUDE (id, title);
+        -- Message history/download, and the FK lookup behind cascading deletes.
+        -- `content` is deliberately not included: long messages would exceed the btree row limit.
+        CREATE INDEX IF NOT EXISTS chat_messages_session_created_idx
+            ON chat_messages (session_id, created_at) INCLUDE (role);
+    """),
+    (3, "cascade session deletes to messages", """
+        DO $$
+        DECLARE fk record;
+        BEGIN
+            FOR fk IN
+                SELECT conname FROM pg_constraint
+                WHERE contype = 'f'
+                  AND conrelid = 'chat_messages'::regclass
+                  AND confrelid = 'chat_sessions'::regclass
+                  AND confdeltype <> 'c'
+            LOOP
+                EXECUTE format('ALTER TABLE chat_messages DROP CONSTRAINT %I', fk.conname);
+            END LOOP;
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE contype = 'f'
+                  AND conrelid = 'chat_messages'::regclass
+                  AND confrelid = 'chat_sessions'::regclass
+            ) THEN
+                ALTER TABLE chat_messages
+                    ADD CONSTRAINT chat_messages_session_id_fkey
+                    FOREIGN KEY (session_id) REFERENCES chat_sessions(id) ON DELETE CASCADE NOT VALID;
+                BEGIN
+                    ALTER TABLE chat_messages VALIDATE CONSTRAINT chat_messages_session_id_fkey;
+                EXCEPTION WHEN foreign_key_violation THEN
+                    -- Legacy orphans: new rows are still checked, old ones are left alone
+                    RAISE NOTICE 'chat_messages has orphaned rows; FK left NOT VALID';
+                END;
+            END IF;
+        END $$;
+    """),
+    (4, "partition chat_messages by month", """
+        DO $$
+        DECLARE
+            seq text;
+            m date;
+        BEGIN
+            IF (SELECT relkind FROM pg_class WHERE oid = 'chat_messages'::regclass) = 'p' THEN
+                RETURN;
+            END IF;
+            IF EXISTS (SELECT 1 FROM chat_messages) THEN
+                -- Copying history here would hold chat_messages locked for the whole copy, at startup
+                RAISE NOTICE 'chat_messages has rows: partition it with `python retention.py --convert`';
+                RETURN;
+            END IF;
+""" + _PARTITION_SWAP + """
+            DROP TABLE chat_messages_legacy;
+        END $$;
+    """),
+    (5, "archived session index", """
+        CREATE TABLE IF NOT EXISTS archived_sessions (
+            session_id INT NOT NULL REFERENCES chat_sessions(id) ON DELETE CASCADE,
+            partition TEXT NOT NULL,
+            archive_file TEXT NOT NULL,
+            byte_offset BIGINT NOT NULL,
+            byte_length BIGINT NOT NULL,
+            message_count INT NOT NULL,
+            archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (session_id, partition)
+        );
+    """),
+]
+
+# Positional $n parameters; params[n - 1] binds $n (a parameter may appear more than once).
+STATEMENTS = {
+    "insert_session": "INSERT INTO chat_sessions (user_id, title) VALUES ($1, $2) RETURNING id, created_at",
+    "list_sessions": (
+        "SELECT id AS session_id, title, created_at FROM chat_sessions "
+        "WHERE user_id = $1 ORDER BY created_at DESC"
+    ),
+    "session_exists": "SELECT id FROM chat_sessions WHERE id = $1",
+    "rename_session": "UPDATE chat_sessions SET title = $1 WHERE id = $2",
+    "delete_session": "DELETE FROM chat_sessions WHERE id = $1",
+    "list_messages": (
+        "SELECT role, content, created_at FROM chat_messages "
+        "WHERE session_id = $1 ORDER BY created_at ASC"
+    ),
+    "insert_message": "INSERT INTO chat_messages (session_id, role, content) VALUES ($1, $2, $3)",
+    "search_questions": (
+        "SELECT s.id AS session_id, s.title, m.content, m.created_at "
+        "FROM chat_messages m JOIN chat_sessions s ON m.session_id = s.id "
+        "WHERE s.user_id = $1 AND m.role = 'user' AND m.content ILIKE $2 "
+        "ORDER BY m.created_at DESC LIMIT $3"
+    ),
+    "archived_segments": (
+        "SELECT partition, archive_file, byte_offset, byte_length FROM archived_sessions "
+        "WHERE session_id = $1 ORDER BY partition"
+    ),
+    "archived_user_segments": (
+        "SELECT a.session_id, s.title, a.partition, a.archive_file, a.byte_offset, a.byte_length "
+        "FROM archived_sessions a JOIN chat_sessions s ON s.id = a.session_id "
+        "WHERE s.user_id = $1 ORDER BY a.partition DESC, a.session_id DESC LIMIT $2"
+    ),
+    # Existing users cost a single indexed read; new ones a single insert.
+    # users.id has no database default (Prisma fills in its uuid client-side),
+    # and NOT NULL is checked before ON CONFLICT, so the id is always supplied.
+    "upsert_user": (
+        "WITH created AS ("
+        "INSERT INTO next_auth.users (id, name, email) VALUES (gen_random_uuid()::text, $1, $2) "
+        "ON CONFLICT (email) DO NOTHING RETURNING id, TRUE AS created"
+        ") SELECT id, created FROM created "
+        "UNION ALL SELECT id, FALSE FROM next_auth.users WHERE email = $2 "
+        "LIMIT 1"
+    ),
+    "insert_feedback": (
+        "INSERT INTO user_feedback (user_id, rating, category, message, contact_email) "
+        "VALUES ($1, $2, $3, $4, $5) RETURNING id, created_at"
+    ),
+}
+
+_PARAM = re.compile(r"\$\d+")
+
+
+def sanitize_dsn(dsn: str) -> str:
+    """Drop query params psycopg2 doesn't understand (e.g., pgbouncer=true)."""
+    try:
+        parsed = urlparse(dsn)
+        q = dict(parse_qsl(parsed.query, keep_blank_values=True))
+        # Remove Node/Prisma-specific flag that psycopg2 can't parse
+        q.pop("pgbouncer", None)
+        new_query = urlencode(q)
+        return urlunparse(parsed._replace(query=new_query))
+    except Exception:
+        return dsn
+
+
+def database_urls() -> list[tuple[str, str]]:
+    """(env var, raw DSN) candidates in the order the backend tries them."""
+    names = ("PY_DATABASE_URL", "DATABASE_URL", "DIRECT_URL")
+    return [(name, os.getenv(name)) for name in names if os.getenv(name)]
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Remembers which STATEMENTS have been prepared on this server session."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def connection_factory(raw_dsn: str):
+    """The psycopg2 connection class to pool for `raw_dsn` (None means the default)."""
+    if not PREPARED_ENABLED:
+        return None
+    try:
+        query = dict(parse_qsl(urlparse(raw_dsn).query))
+    except Exception:
+        query = {}
+    if query.get("pgbouncer", "").lower() == "true":
+        return None
+    return PreparingConnection
+
+
+def execute(cursor, name: str, params=()):
+    """Run STATEMENTS[name], prepared on first use when the connection supports it."""
+    sql = STATEMENTS[name]
+    prepared = getattr(cursor.connection, "prepared", None)
+    if prepared is None:
+        cursor.execute(
+            _PARAM.sub(lambda m: f"%(p{m.group(0)[1:]})s", sql),
+            {f"p{i}": value for i, value in enumerate(params, start=1)},
+        )
+        return
+    if name not in prepared:
+        cursor.execute(f"PREPARE {name} AS {sql}")
+        prepared.add(name)
+    args = f" ({', '.join(['%s'] * len(params))})" if params else ""
+    try:
+        cursor.execute(f"EXECUTE {name}{args}", params)
+    except psycopg2.errors.InvalidSqlStatementName:
+        # Server session was reset under us; prepare again on the next call
+        prepared.discard(name)
+        raise
+
+
+def migrate(conn) -> list[str]:
+    """Apply pending migrations in one transaction. Returns the names of those applied."""
+    applied = []
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                "version INT PRIMARY KEY, name TEXT NOT NULL, applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW())"
+            )
+            cursor.execute("SELECT version FROM schema_migrations")
+            done = {row[0] if isinstance(row, tuple) else row["version"] for row in cursor.fetchall()}
+            for version, name, sql in MIGRATIONS:
+                if version in done:
+                    continue
+                cursor.execute(sql)
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                applied.append(name)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return applied
+
+
+def month_start(value: date | datetime) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"chat_messages_p{month:%Y%m}"
+
+
+def partition_month(name: str) -> date | None:
+    m = re.fullmatch(r"chat_messages_p(\d{4})(\d{2})", name)
+    return date(int(m.group(1)), int(m.group(2)), 1) if m else None
+
+
+def relation_kind(conn, name: str) -> str | None:
+    """pg_class.relkind of `name` ('r' plain table, 'p' partitioned), None if it doesn't exist."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (name,))
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return row[0] if isinstance(row, tuple) else row["relkind"]
+
+
+def list_partitions(conn) -> list[str]:
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname AS name FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'chat_messages'::regclass ORDER BY c.relname"
+        )
+        return [row[0] if isinstance(row, tuple) else row["name"] for row in cursor.fetchall()]
+
+
+def _default_months(conn) -> set[date]:
+    """Months (UTC) that have rows in the default partition."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC')::date AS month "
+            "FROM chat_messages_default"
+        )
+        return {row[0] if isinstance(row, tuple) else row["month"] for row in cursor.fetchall()}
+
+
+def _create_partition(conn, month: date):
+    """Create one month's partition, moving any of its rows out of the default partition first.
+
+    Postgres refuses to create a partition whose range already has rows in the
+    default, so those are moved in the same transaction: detach the default,
+    create the partition, move the rows, reattach.
+    """
+    name = partition_name(month)
+    bounds = (f"{month:%Y-%m-%d} 00:00:00+00", f"{add_months(month, 1):%Y-%m-%d} 00:00:00+00")
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM chat_messages_default WHERE created_at >= %s AND created_at < %s)", bounds,
+        )
+        row = cursor.fetchone()
+        stranded = row[0] if isinstance(row, tuple) else row["exists"]
+        if stranded:
+            cursor.execute("ALTER TABLE chat_messages DETACH PARTITION chat_messages_default")
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF chat_messages FOR VALUES FROM (%s) TO (%s)', bounds,
+        )
+        if stranded:
+            cursor.execute(
+                f'INSERT INTO "{name}" SELECT * FROM chat_messages_default WHERE created_at >= %s AND created_at < %s',
+                bounds,
+            )
+            cursor.execute("DELETE FROM chat_messages_default WHERE created_at >= %s AND created_at < %s", bounds)
+            cursor.execute("ALTER TABLE chat_messages ATTACH PARTITION chat_messages_default DEFAULT")
+
+
+def ensure_partitions(conn, months_ahead: int = PARTITION_MONTHS_AHEAD, today: date | None = None) -> list[str]:
+    """Create monthly partitions from the current month to `months_ahead` months on. Returns those created.
+
+    Months that only have rows in the default partition (because nothing
+    created their partition in time) get one too, so those rows become
+    ordinary partitions that retention.py can archive.
+    """
+    if relation_kind(conn, "chat_messages") != "p":
+        # Not converted yet (see retention.py --convert): nothing to partition
+        conn.commit()
+        return []
+    current = month_start(today or datetime.now(timezone.utc))
+    existing = set(list_partitions(conn))
+    months = {add_months(current, n) for n in range(months_ahead + 1)}
+    if "chat_messages_default" in existing:
+        months |= _default_months(conn)
+        conn.commit()
+    created = []
+    for month in sorted(months):
+        name = partition_name(month)
+        if name in existing:
+            continue
+        try:
+            _create_partition(conn, month)
+            conn.commit()
+            created.append(name)
+        except Exception as e:
+            conn.rollback()
+            print(f"[backend] Could not create partition {name}: {e}")
+    return created
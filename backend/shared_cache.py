@@ -0,0 +1,281 @@
+"""Key/value caches shared by every worker on a host (or a whole fleet).
+
+SHARED_CACHE picks the backend:
+- `shm` (default where /dev/shm exists): a SQLite file in shared memory,
+  visible to every worker process on the host, no extra service needed.
+  It lives in a directory private to the service's user
+  ($XDG_RUNTIME_DIR/securum, else /dev/shm/securum-<uid>, mode 0700) and is
+  created 0600; a directory or file that another user owns or can open is
+  refused, and the cache falls back to `memory`.
+- `redis`: any Redis-compatible server at SHARED_CACHE_URL, for several hosts.
+  Needs the `redis` package.
+- `memory`: a per-process LRU; the old behaviour, and the fallback.
+
+Values are JSON. Entries live in namespaces with their own TTL; `clear()`
+drops a whole namespace at once (e.g. answers after a knowledge-base
+reload), and `update()` is an atomic read-modify-write across all workers
+(used by ratelimit.py). Cache failures are logged and treated as misses,
+never as errors.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+def _default_shm_dir() -> str:
+    if os.getenv("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "securum")
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, f"securum-{os.getuid()}" if hasattr(os, "getuid") else "securum")
+
+
+BACKEND = os.getenv("SHARED_CACHE", "shm" if os.path.isdir("/dev/shm") else "memory").strip().lower()
+REDIS_URL = os.getenv("SHARED_CACHE_URL", "redis://localhost:6379/0")
+SHM_PATH = os.getenv("SHARED_CACHE_PATH", os.path.join(_default_shm_dir(), "cache.sqlite3"))
+MEMORY_MAX_ENTRIES = int(os.getenv("SHARED_CACHE_MEMORY_ENTRIES", "10000"))
+TRANSLATION_TTL_SECONDS = int(os.getenv("TRANSLATION_CACHE_TTL_SECONDS", str(7 * 86400)))
+ANSWER_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+
+
+def _check_private(st: os.stat_result, what: str):
+    """Only this uid may own or open it: anyone else could read cached answers or plant their own."""
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        raise PermissionError(f"{what} is owned by uid {st.st_uid}, not {os.getuid()}")
+    if stat.S_IMODE(st.st_mode) & 0o077:
+        raise PermissionError(f"{what} is accessible to other users (mode {stat.S_IMODE(st.st_mode):o})")
+
+
+def _private_file(path: str):
+    """Create `path` (and its directory) for this user only, or check that an existing one is."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode):
+        raise PermissionError(f"{directory} is not a directory")
+    _check_private(st, directory)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0), 0o600)
+    try:
+        _check_private(os.fstat(fd), path)
+    finally:
+        os.close(fd)
+
+
+def digest(*parts: str) -> str:
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+class MemoryStore:
+    def __init__(self, max_entries: int = MEMORY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str):
+        with self._lock:
+            entry = self._data.get((namespace, key))
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._data[(namespace, key)]
+                return None
+            self._data.move_to_end((namespace, key))
+            return entry[1]
+
+    def set(self, namespace: str, key: str, value: str, ttl: float):
+        with self._lock:
+            self._data[(namespace, key)] = (time.time() + ttl, value)
+            self._data.move_to_end((namespace, key))
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def update(self, namespace: str, key: str, fn, ttl: float):
+        with self._lock:
+            entry = self._data.get((namespace, key))
+            current = entry[1] if entry is not None and entry[0] > time.time() else None
+            value = fn(current)
+            self._data[(namespace, key)] = (time.time() + ttl, value)
+            self._data.move_to_end((namespace, key))
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            return value
+
+    def clear(self, namespace: str):
+        with self._lock:
+            for k in [k for k in self._data if k[0] == namespace]:
+                del self._data[k]
+
+
+class SqliteStore:
+    """One SQLite file (in /dev/shm by default) shared by all local processes of one user."""
+
+    def __init__(self, path: str = SHM_PATH):
+        _private_file(path)
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+        self._last_purge = 0.0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace: str, key: str):
+        row = self._conn().execute(
+            "SELECT value FROM cache WHERE namespace=? AND key=? AND expires>?", (namespace, key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, namespace: str, key: str, value: str, ttl: float):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+            (namespace, key, value, now + ttl),
+        )
+        if now - self._last_purge > 60:
+            self._last_purge = now
+            conn.execute("DELETE FROM cache WHERE expires<=?", (now,))
+
+    def update(self, namespace: str, key: str, fn, ttl: float):
+        conn = self._conn()
+        now = time.time()
+        # IMMEDIATE takes the write lock up front, serialising updates across processes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value FROM cache WHERE namespace=? AND key=? AND expires>?", (namespace, key, now),
+            ).fetchone()
+            value = fn(row[0] if row else None)
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+                (namespace, key, value, now + ttl),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def clear(self, namespace: str):
+        self._conn().execute("DELETE FROM cache WHERE namespace=?", (namespace,))
+
+
+class RedisStore:
+    """Redis-compatible server; namespaces are cleared by bumping a generation counter."""
+
+    def __init__(self, url: str = REDIS_URL):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self._watch_error = redis.WatchError
+
+    def _key(self, namespace: str, key: str) -> str:
+        generation = int(self.client.get(f"securum:{namespace}:gen") or 0)
+        return f"securum:{namespace}:{generation}:{key}"
+
+    def get(self, namespace: str, key: str):
+        value = self.client.get(self._key(namespace, key))
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, namespace: str, key: str, value: str, ttl: float):
+        self.client.set(self._key(namespace, key), value, ex=max(1, int(ttl)))
+
+    def update(self, namespace: str, key: str, fn, ttl: float):
+        full_key = self._key(namespace, key)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(full_key)
+                    current = pipe.get(full_key)
+                    value = fn(current.decode("utf-8") if current is not None else None)
+                    pipe.multi()
+                    pipe.set(full_key, value, ex=max(1, int(ttl)))
+                    pipe.execute()
+                    return value
+                except self._watch_error:
+                    # Another worker changed the key first; retry on its value
+                    continue
+
+    def clear(self, namespace: str):
+        # Old generations simply expire
+        self.client.incr(f"securum:{namespace}:gen")
+
+
+def _make_store():
+    try:
+        if BACKEND == "redis":
+            return RedisStore()
+        if BACKEND == "shm":
+            return SqliteStore()
+    except Exception as e:
+        print(f"[backend] Shared cache backend {BACKEND!r} unavailable, using per-process memory: {e}")
+    return MemoryStore()
+
+
+store = _make_store()
+
+
+class Namespace:
+    def __init__(self, name: str, ttl: float, backing=None, track: bool = True):
+        self.name = name
+        self.ttl = ttl
+        self.store = backing or store
+        # Hit/miss counters only make sense for caches, not for counters kept here
+        self.track = track
+
+    def get(self, key: str):
+        try:
+            value = self.store.get(self.name, key)
+        except Exception as e:
+            print(f"Shared cache read failed ({self.name}): {e}")
+            value = None
+        if self.track:
+            metrics.CACHE_EVENTS.inc(cache=self.name, result="miss" if value is None else "hit")
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value):
+        try:
+            self.store.set(self.name, key, json.dumps(value), self.ttl)
+        except Exception as e:
+            print(f"Shared cache write failed ({self.name}): {e}")
+
+    def update(self, key: str, fn):
+        """Atomically replace the value with `fn(current or None)` and return it; None if the store failed."""
+        try:
+            raw = self.store.update(
+                self.name, key, lambda current: json.dumps(fn(json.loads(current) if current is not None else None)),
+                self.ttl,
+            )
+        except Exception as e:
+            print(f"Shared cache update failed ({self.name}): {e}")
+            return None
+        return json.loads(raw)
+
+    def clear(self):
+        try:
+            self.store.clear(self.name)
+        except Exception as e:
+            print(f"Shared cache clear failed ({self.name}): {e}")
+
+
+translations = Namespace("translation", TRANSLATION_TTL_SECONDS)
+# Keyed by prompt, style and the retrieved context; cleared on knowledge-base reloads
+answers = Namespace("answer", ANSWER_TTL_SECONDS)
@@ -0,0 +1,120 @@
+"""Coalesce identical in-flight LLM work.
+
+When many users ask the same question at once, only the first request
+(the leader) runs retrieval and generation; concurrent duplicates attach to
+it. `SingleFlight.do` shares a final result, `SingleFlight.stream` fans one
+chunk stream out to every subscriber, replaying what they missed. Entries
+are dropped as soon as the leader finishes, so nothing is cached here.
+"""
+import re
+import threading
+from concurrent.futures import Future
+
+import metrics
+
+_SPACE = re.compile(r"\s+")
+
+
+def make_key(english_prompt: str, style: str | None) -> str:
+    """Normalize prompt and style so trivially different duplicates coalesce."""
+    prompt = _SPACE.sub(" ", (english_prompt or "").strip().lower()).rstrip(" ?!.")
+    return f"{(style or 'long').strip().lower()}\x00{prompt}"
+
+
+class SharedStream:
+    """Chunks published by a leader, readable from the start by any number of followers."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def publish(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error: BaseException | None = None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def __iter__(self):
+        position = 0
+        while True:
+            with self._cond:
+                while position >= len(self.chunks) and not self.done:
+                    self._cond.wait()
+                pending = self.chunks[position:]
+                done, error = self.done, self.error
+            yield from pending
+            position += len(pending)
+            if done and position >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+
+    def do(self, key: str, fn):
+        """Run `fn()` once for concurrent callers with the same key and share its result."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            metrics.CACHE_EVENTS.inc(cache=self.name, result="coalesced")
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def stream(self, key: str, producer):
+        """Iterate `producer()` once for concurrent callers with the same key.
+
+        The leader drives the generator and publishes each chunk; followers
+        replay from the first chunk and then follow live.
+        """
+        with self._lock:
+            shared = self._streams.get(key)
+            leader = shared is None
+            if leader:
+                shared = self._streams[key] = SharedStream()
+        if not leader:
+            metrics.CACHE_EVENTS.inc(cache=self.name, result="coalesced")
+            yield from shared
+            return
+
+        error = None
+        try:
+            for chunk in producer():
+                shared.publish(chunk)
+                yield chunk
+        except GeneratorExit:
+            error = RuntimeError("Coalesced stream was abandoned by its leader")
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            with self._lock:
+                self._streams.pop(key, None)
+            shared.finish(error)
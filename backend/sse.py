@@ -0,0 +1,219 @@
+"""Server-Sent Events transport for /chat/stream.
+
+A generation runs on its own thread and appends coalesced text chunks to a
+`StreamBuffer`; HTTP responses are just subscribers that replay the buffer
+from a position and then tail it. That gives us:
+
+- proper `id:`/`data:` framing, one event per coalesced chunk
+- fewer writes: after the first token, which is sent at once, tokens are
+  merged until COALESCE_CHARS or until COALESCE_SECONDS have passed, even
+  if no further token has arrived
+- `: ping` comments every HEARTBEAT_SECONDS so proxies keep the link open
+- resumable streams: a client reconnecting with `Last-Event-ID` replays what
+  it missed from the buffer instead of starting a new generation; buffers
+  are kept for REPLAY_TTL_SECONDS after the generation finishes
+
+Buffers are in-process, so behind several workers a resuming client must
+reach the worker that started its stream (sticky routing, e.g. by client
+IP). An unknown stream id is answered with 404, never a new generation.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+COALESCE_CHARS = int(os.getenv("SSE_COALESCE_CHARS", "64"))
+COALESCE_SECONDS = float(os.getenv("SSE_COALESCE_MS", "50")) / 1000.0
+HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+REPLAY_TTL_SECONDS = float(os.getenv("SSE_REPLAY_TTL_SECONDS", "120"))
+
+HEARTBEAT = ": ping\n\n"
+
+
+def format_event(data: str, event_id: str | None = None, event: str | None = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    for line in data.split("\n"):
+        lines.append(f"data: {line}")
+    return "\n".join(lines) + "\n\n"
+
+
+def parse_event_id(value: str | None):
+    """Split a `<stream_id>:<seq>` event id. Returns (None, 0) if malformed."""
+    if not value or ":" not in value:
+        return None, 0
+    stream_id, _, seq = value.rpartition(":")
+    try:
+        return stream_id, int(seq)
+    except ValueError:
+        return None, 0
+
+
+class StreamBuffer:
+    """Append-only event log for one generation, shared by all its subscribers."""
+
+    def __init__(self, stream_id: str):
+        self.stream_id = stream_id
+        self.events = []  # (seq, event, data); seq starts at 1
+        self.done = False
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._waiters = set()
+
+    def append(self, data: str, event: str | None = None):
+        with self._lock:
+            self.events.append((len(self.events) + 1, event, data))
+        self._wake()
+
+    def close(self):
+        with self._lock:
+            self.done = True
+            self.finished_at = time.monotonic()
+        self._wake()
+
+    def _wake(self):
+        with self._lock:
+            waiters = list(self._waiters)
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(waiter.set)
+
+    async def subscribe(self, after_seq: int = 0, heartbeat: float = HEARTBEAT_SECONDS):
+        """Yield SSE-formatted events after `after_seq`, heartbeats while idle."""
+        loop = asyncio.get_running_loop()
+        waiter = asyncio.Event()
+        token = (loop, waiter)
+        with self._lock:
+            self._waiters.add(token)
+        try:
+            position = after_seq
+            while True:
+                waiter.clear()
+                with self._lock:
+                    pending = self.events[position:]
+                    done = self.done
+                for seq, event, data in pending:
+                    yield format_event(data, f"{self.stream_id}:{seq}", event)
+                    position = seq
+                if done and not pending:
+                    return
+                if pending:
+                    continue
+                try:
+                    await asyncio.wait_for(waiter.wait(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT
+        finally:
+            with self._lock:
+                self._waiters.discard(token)
+
+
+class StreamRegistry:
+    """Live and recently finished streams, addressable by id for resumption."""
+
+    def __init__(self, ttl: float = REPLAY_TTL_SECONDS):
+        self.ttl = ttl
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def get(self, stream_id: str | None) -> StreamBuffer | None:
+        if not stream_id:
+            return None
+        self._purge()
+        with self._lock:
+            return self._streams.get(stream_id)
+
+    def start(self, chunks, on_complete=None) -> StreamBuffer:
+        """Run the text generator `chunks` on a background thread into a new buffer.
+
+        `on_complete(full_text)` runs on that thread once the generator is
+        exhausted, whether or not any client is still connected.
+        """
+        self._purge()
+        buffer = StreamBuffer(uuid.uuid4().hex)
+        with self._lock:
+            self._streams[buffer.stream_id] = buffer
+        context = contextvars.copy_context()
+        thread = threading.Thread(
+            target=context.run, args=(_produce, buffer, chunks, on_complete), daemon=True,
+        )
+        thread.start()
+        return buffer
+
+    def _purge(self):
+        cutoff = time.monotonic() - self.ttl
+        with self._lock:
+            expired = [
+                sid for sid, buf in self._streams.items()
+                if buf.done and buf.finished_at is not None and buf.finished_at < cutoff
+            ]
+            for sid in expired:
+                del self._streams[sid]
+
+
+_END = object()
+
+
+def _pump(chunks, items: queue.Queue):
+    """Drain the generator into `items`, so the producer can flush on a timer between tokens."""
+    try:
+        for chunk in chunks:
+            if chunk:
+                items.put(chunk)
+    except Exception as e:
+        print(f"Error during streaming: {e}")
+    finally:
+        items.put(_END)
+
+
+def _produce(buffer: StreamBuffer, chunks, on_complete):
+    parts = []
+    pending = []
+    pending_chars = 0
+    deadline = None
+    items = queue.Queue()
+    threading.Thread(
+        target=contextvars.copy_context().run, args=(_pump, chunks, items), daemon=True,
+    ).start()
+    try:
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                chunk = items.get(timeout=timeout)
+            except queue.Empty:
+                # Nothing new within COALESCE_SECONDS: send what we have
+                buffer.append("".join(pending))
+                pending, pending_chars, deadline = [], 0, None
+                continue
+            if chunk is _END:
+                break
+            parts.append(chunk)
+            if len(parts) == 1:
+                # First token goes out at once; it is what the user waits for
+                buffer.append(chunk)
+                continue
+            pending.append(chunk)
+            pending_chars += len(chunk)
+            if deadline is None:
+                deadline = time.monotonic() + COALESCE_SECONDS
+            if pending_chars >= COALESCE_CHARS:
+                buffer.append("".join(pending))
+                pending, pending_chars, deadline = [], 0, None
+    finally:
+        if pending:
+            buffer.append("".join(pending))
+        full_text = "".join(parts)
+        meta = {}
+        if on_complete is not None:
+            try:
+                meta = on_complete(full_text) or {}
+            except Exception as e:
+                print("Error finishing stream:", e)
+        buffer.append(json.dumps(meta), event="done")
+        buffer.close()
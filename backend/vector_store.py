@@ -0,0 +1,195 @@
+"""Versioned Chroma collections behind an alias, with blue/green promotion.
+
+Rebuilds never touch the collection that is serving traffic. A new
+`cybersecurity_v{n}` is built next to it, smoke-tested, and then promoted
+by atomically rewriting `aliases.json` in the Chroma directory. Serving
+processes hold a `CollectionHandle`, which notices the alias change and
+hot-swaps to the new version without a restart. The previous versions stay
+on disk for rollback until garbage-collected.
+
+Before the first promotion the alias resolves to the legacy, unversioned
+`cybersecurity` collection.
+"""
+import json
+import os
+import re
+import threading
+import time
+
+CHROMA_PATH = os.getenv("CHROMA_PATH", "chroma_db")
+ALIAS = "cybersecurity"
+KEEP_VERSIONS = int(os.getenv("VECTOR_KEEP_VERSIONS", "2"))
+ALIAS_CHECK_SECONDS = float(os.getenv("VECTOR_ALIAS_CHECK_SECONDS", "1"))
+SMOKE_QUERIES = (
+    "How do I recognise a phishing link?",
+    "How can I secure my password?",
+    "What should I do after a malware infection?",
+)
+
+
+def alias_path(chroma_path: str = CHROMA_PATH) -> str:
+    return os.path.join(chroma_path, "aliases.json")
+
+
+def read_aliases(chroma_path: str = CHROMA_PATH) -> dict:
+    try:
+        with open(alias_path(chroma_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_aliases(aliases: dict, chroma_path: str = CHROMA_PATH):
+    path = alias_path(chroma_path)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(aliases, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def active_name(alias: str = ALIAS, chroma_path: str = CHROMA_PATH) -> str:
+    return read_aliases(chroma_path).get(alias, {}).get("active") or alias
+
+
+def _collection_names(client) -> list[str]:
+    names = []
+    for c in client.list_collections():
+        names.append(c if isinstance(c, str) else c.name)
+    return names
+
+
+def list_versions(client, alias: str = ALIAS) -> list[tuple[int, str]]:
+    pattern = re.compile(rf"^{re.escape(alias)}_v(\d+)$")
+    versions = []
+    for name in _collection_names(client):
+        m = pattern.match(name)
+        if m:
+            versions.append((int(m.group(1)), name))
+    return sorted(versions)
+
+
+def next_version_name(client, alias: str = ALIAS) -> str:
+    versions = list_versions(client, alias)
+    return f"{alias}_v{versions[-1][0] + 1 if versions else 1}"
+
+
+def validate(collection, expected_count: int, queries=SMOKE_QUERIES) -> list[str]:
+    """Smoke-test a freshly built collection. Returns a list of problems (empty if OK)."""
+    problems = []
+    count = collection.count()
+    if count != expected_count:
+        problems.append(f"expected {expected_count} chunks, found {count}")
+    for query in queries:
+        try:
+            results = collection.query(query_texts=[query], n_results=1)
+            if not (results.get("documents") or [[]])[0]:
+                problems.append(f"no results for smoke query {query!r}")
+        except Exception as e:
+            problems.append(f"smoke query {query!r} failed: {e}")
+    return problems
+
+
+def promote(name: str, alias: str = ALIAS, chroma_path: str = CHROMA_PATH, client=None):
+    """Point `alias` at `name`; the previous target is kept for rollback.
+
+    On the first promotion the previous target is the legacy, unversioned
+    collection named like the alias, recorded when `client` shows it exists.
+    """
+    aliases = read_aliases(chroma_path)
+    entry = aliases.get(alias, {})
+    previous = entry.get("active")
+    if alias not in aliases and client is not None and alias in _collection_names(client):
+        previous = alias
+    history = [n for n in entry.get("history", []) if n != name]
+    if previous and previous != name:
+        history.insert(0, previous)
+    aliases[alias] = {"active": name, "history": history, "promoted_at": time.time()}
+    _write_aliases(aliases, chroma_path)
+
+
+def rollback(alias: str = ALIAS, chroma_path: str = CHROMA_PATH) -> str:
+    """Re-point `alias` at the most recent previous version. Returns its name."""
+    aliases = read_aliases(chroma_path)
+    entry = aliases.get(alias, {})
+    history = list(entry.get("history", []))
+    if not history:
+        raise RuntimeError(f"No previous version of {alias!r} to roll back to")
+    target = history.pop(0)
+    aliases[alias] = {"active": target, "history": history, "promoted_at": time.time()}
+    _write_aliases(aliases, chroma_path)
+    return target
+
+
+def remove_alias(alias: str = ALIAS, chroma_path: str = CHROMA_PATH):
+    aliases = read_aliases(chroma_path)
+    if aliases.pop(alias, None) is not None:
+        _write_aliases(aliases, chroma_path)
+
+
+def gc(client, alias: str = ALIAS, keep: int = KEEP_VERSIONS, chroma_path: str = CHROMA_PATH) -> list[str]:
+    """Delete versions that are neither active nor among the `keep` most recent previous ones."""
+    entry = read_aliases(chroma_path).get(alias, {})
+    retained = {entry.get("active")} | set(entry.get("history", [])[:keep])
+    deleted = []
+    for _, name in list_versions(client, alias):
+        if name not in retained:
+            client.delete_collection(name)
+            deleted.append(name)
+    if deleted:
+        aliases = read_aliases(chroma_path)
+        if alias in aliases:
+            aliases[alias]["history"] = [n for n in aliases[alias].get("history", []) if n not in deleted]
+            _write_aliases(aliases, chroma_path)
+    return deleted
+
+
+class CollectionHandle:
+    """The serving process's view of the active collection, hot-swapped on promotion."""
+
+    def __init__(self, client, embedding_function=None, alias: str = ALIAS, chroma_path: str = CHROMA_PATH):
+        self.client = client
+        self.embedding_function = embedding_function
+        self.alias = alias
+        self.chroma_path = chroma_path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self.name = None
+        self.collection = None
+        self._refresh(force=True)
+
+    def _alias_mtime(self):
+        try:
+            return os.stat(alias_path(self.chroma_path)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _refresh(self, force: bool = False):
+        mtime = self._alias_mtime()
+        if not force and mtime == self._mtime:
+            return
+        name = active_name(self.alias, self.chroma_path)
+        if name == self.alias:
+            collection = self.client.get_or_create_collection(
+                name=name, embedding_function=self.embedding_function,
+            )
+        else:
+            collection = self.client.get_collection(name=name, embedding_function=self.embedding_function)
+        if self.name is not None and name != self.name:
+            print(f"[backend] Vector collection swapped: {self.name} -> {name}")
+        self.collection, self.name, self._mtime = collection, name, mtime
+
+    def get(self):
+        now = time.monotonic()
+        if now - self._checked_at >= ALIAS_CHECK_SECONDS:
+            with self._lock:
+                if now - self._checked_at >= ALIAS_CHECK_SECONDS:
+                    self._checked_at = now
+                    try:
+                        self._refresh()
+                    except Exception as e:
+                        # Keep serving the old version if the new one can't be opened
+                        print(f"[backend] Failed to switch vector collection: {e}")
+        return self.collection
@@ -8,6 +8,26 @@ import { headers as nextHeaders } from "next/headers";
 import { sendEmail } from "@/lib/mail";
 import { loginAlertEmail } from "@/lib/emailTemplates";
 import { compare, hash } from "bcryptjs";
+
+const API_BASE = process.env.NEXT_PUBLIC_API_BASE || "http://localhost:8000";
+
+// Exchange Google's ID token for the Python backend's own session token,
+// which the browser sends as `Authorization: Bearer` on chat calls.
+async function backendSession(idToken: string) {
+  try {
+    const res = await fetch(`${API_BASE}/auth/google`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ token: idToken }),
+    });
+    if (!res.ok) throw new Error(`HTTP ${res.status}`);
+    const data = await res.json();
+    return { token: data.session_token as string, expires: data.expires_at as number };
+  } catch (e) {
+    console.warn("[auth] backend session token failed:", e);
+    return null;
+  }
+}
  
 export const authOptions: NextAuthOptions = {
   adapter: PrismaAdapter(prisma),
@@ -84,7 +104,13 @@ export const authOptions: NextAuthOptions = {
   },
 
   callbacks: {
-    async jwt({ token, user, trigger, session }) {
+    async jwt({ token, user, account, trigger, session }) {
+      if (account?.provider === "google" && account.id_token) {
+        // Only at sign-in: credential logins have no Google token and stay unauthenticated to the backend
+        const backend = await backendSession(account.id_token);
+        (token as any).backendToken = backend?.token;
+        (token as any).backendTokenExpires = backend?.expires;
+      }
       if (user) {
         token.id = (user as any).id;
         if ((user as any).name) token.name = (user as any).name;
@@ -114,6 +140,11 @@ export const authOptions: NextAuthOptions = {
         if (token.name) session.user.name = token.name as string;
         if (token.email && !session.user.email) session.user.email = token.email as string;
       }
+      const t: any = token;
+      // Expired backend tokens would only earn 401s; without one the backend treats calls as before
+      if (t?.backendToken && t.backendTokenExpires * 1000 > Date.now()) {
+        (session as any).backendToken = t.backendToken;
+      }
       return session;
     },
   },
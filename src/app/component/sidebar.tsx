@@ -10,6 +10,7 @@ import { ScrollArea } from "@/components/ui/scroll-area"
 import { Separator } from "@/components/ui/separator"
 import { Tooltip, TooltipContent, TooltipProvider, TooltipTrigger } from "@/components/ui/tooltip"
 import { translations } from "../translations"
+import { backendAuthHeaders } from "@/lib/utils"
 import { Download } from "lucide-react";
 import { Input } from "@/components/ui/input";
 import {
@@ -110,6 +111,7 @@ const handleDownload = async (format: 'pdf' | 'docx' | 'csv') => {
       setLoading(true)
       setError(null)
       const res = await axios.get(`${apiBaseUrl}/chat/sessions/${userId}`, {
+        headers: backendAuthHeaders(auth),
         cancelToken: cancelRef.current.token,
       })
       // Accept both shapes: [{ id, title, created_at }] or [{ session_id, ... }]
@@ -242,7 +244,7 @@ const handleDownload = async (format: 'pdf' | 'docx' | 'csv') => {
       formData.append("title", "New Chat")
 
       const res = await axios.post(`${apiBaseUrl}/chat/session`, formData, {
-        headers: { "Content-Type": "multipart/form-data" },
+        headers: { "Content-Type": "multipart/form-data", ...backendAuthHeaders(auth) },
       })
 
       const sid = res.data?.session_id ?? res.data?.id
@@ -283,6 +285,7 @@ const handleDownload = async (format: 'pdf' | 'docx' | 'csv') => {
       searchCancelRef.current = axios.CancelToken.source()
       const res = await axios.get(`${apiBaseUrl}/chat/search`, {
         params: { user_id: userId, q: q.trim() },
+        headers: backendAuthHeaders(auth),
         cancelToken: searchCancelRef.current.token,
       })
       const rows = Array.isArray(res.data) ? res.data : []
@@ -27,7 +27,7 @@ import {
 } from "@/components/ui/dialog";
 import Quizz from "./component/quizz";
 import Sidebar from "./component/sidebar";
-import { cn } from "@/lib/utils";
+import { backendAuthHeaders, cn } from "@/lib/utils";
 import { DialogTitle } from "@radix-ui/react-dialog";
 import TypewriterText from "@/components/TypewriterText";
 
@@ -224,7 +224,7 @@ export default function Home() {
         formData.append("file", selectedFile);
 
         const res = await axios.post("http://localhost:8000/chat/message", formData, {
-          headers: { "Content-Type": "multipart/form-data" },
+          headers: { "Content-Type": "multipart/form-data", ...backendAuthHeaders(session) },
         });
 
         const botResponse = res.data?.response || "No response from server.";
@@ -261,7 +261,7 @@ export default function Home() {
         const userId = session?.user?.id || `guest_${crypto.randomUUID()}`;
         const response = await fetch("http://localhost:8000/chat/stream", {
           method: "POST",
-          headers: { "Content-Type": "application/json" },
+          headers: { "Content-Type": "application/json", ...backendAuthHeaders(session) },
           body: JSON.stringify({
             prompt,
             user_id: userId,
@@ -284,18 +284,54 @@ export default function Home() {
         }
         if (!response.body) throw new Error("Response body is null");
 
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
-
-        while (true) {
-          const { done, value } = await reader.read();
-          if (done) break;
-          const chunk = decoder.decode(value);
-          setMessages((prevMessages) => {
-            const lastMessage = prevMessages[prevMessages.length - 1];
-            const updatedLastMessage = { ...lastMessage, text: lastMessage.text + chunk } as ChatMessage;
-            return [...prevMessages.slice(0, -1), updatedLastMessage];
-          });
+        // Server-Sent Events: `data:` lines carry text, `: ping` lines are heartbeats,
+        // and `event: done` ends the answer. On a dropped connection, resume from the
+        // last event id instead of regenerating the answer.
+        const streamId = response.headers.get("x-stream-id");
+        let lastEventId: string | null = null;
+        let finished = false;
+        let body: ReadableStream<Uint8Array> | null = response.body;
+        for (let attempt = 0; body && !finished && attempt < 4; attempt++) {
+          const reader = body.getReader();
+          const decoder = new TextDecoder();
+          let buffered = "";
+          try {
+            while (true) {
+              const { done, value } = await reader.read();
+              if (done) break;
+              buffered += decoder.decode(value, { stream: true });
+              let boundary;
+              while ((boundary = buffered.indexOf("\n\n")) !== -1) {
+                const rawEvent = buffered.slice(0, boundary);
+                buffered = buffered.slice(boundary + 2);
+                let eventType = "message";
+                const dataLines: string[] = [];
+                for (const line of rawEvent.split("\n")) {
+                  if (line.startsWith("id:")) lastEventId = line.slice(3).trim();
+                  else if (line.startsWith("event:")) eventType = line.slice(6).trim();
+                  else if (line.startsWith("data:")) dataLines.push(line.slice(line.startsWith("data: ") ? 6 : 5));
+                }
+                if (eventType === "done") {
+                  finished = true;
+                  continue;
+                }
+                if (dataLines.length === 0) continue;
+                const chunk = dataLines.join("\n");
+                setMessages((prevMessages) => {
+                  const lastMessage = prevMessages[prevMessages.length - 1];
+                  const updatedLastMessage = { ...lastMessage, text: lastMessage.text + chunk } as ChatMessage;
+                  return [...prevMessages.slice(0, -1), updatedLastMessage];
+                });
+              }
+            }
+            finished = true;
+          } catch (streamErr) {
+            if (!streamId) throw streamErr;
+            const resumed = await fetch(`http://localhost:8000/chat/stream/${streamId}`, {
+              headers: lastEventId ? { "Last-Event-ID": lastEventId } : {},
+            });
+            body = resumed.ok ? resumed.body : null;
+          }
         }
         setMessages((prev) => {
           if (prev.length === 0) return prev;
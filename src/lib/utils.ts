@@ -4,3 +4,9 @@ import { twMerge } from "tailwind-merge"
 export function cn(...inputs: ClassValue[]) {
   return twMerge(clsx(inputs))
 }
+
+/** `Authorization` header for the Python backend, when sign-in obtained a backend session token. */
+export function backendAuthHeaders(session: unknown): Record<string, string> {
+  const token = (session as any)?.backendToken
+  return token ? { Authorization: `Bearer ${token}` } : {}
+}